@@ -1,13 +1,13 @@
 from fastapi import APIRouter
 
-from . import healthz, chat
+from . import healthz, chat, knowledge
 
 __all__ = ["router"]
 
 router = APIRouter()
 
 # modules = [healthz, exercise, chat, user, history, config, file, course, task, task_exercise]
-modules = [chat]
+modules = [healthz, chat, knowledge]
 
 for module in modules:
     router.include_router(module.router)
@@ -4,6 +4,7 @@ import logging
 from typing import Annotated
 
 from fastapi import APIRouter, Depends
+from starlette.background import BackgroundTask
 from starlette.responses import StreamingResponse
 from utilswaves.authentication import get_current_user
 from utilswaves.schema import ApiResponse
@@ -14,7 +15,7 @@ from app.core.manager import (
 )
 from app.core.schema import CurrentUser, Session
 from app.core.service.chat import ChatService, get_chat_service
-from app.vo.session import SendMessageRequest, UserLogin, AnswerRequest, SendDbinfo, DBtier1, DBtier2, SearchDB
+from app.vo.session import SendMessageRequest, UserLogin, AnswerRequest, SendDbinfo, DBtier1, DBtier2, SearchDB, DeleteSessionRequest
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +34,18 @@ async def init_session(
     session = await history_manager.create_chat_session(body.user_id)
     return ApiResponse(data=session)
 
+@router.post(
+    "/delete_session",
+    summary="删除会话",
+    response_model=ApiResponse[int],
+)
+async def delete_session(
+    body: DeleteSessionRequest,
+    history_manager: Annotated[HistoryManager, Depends(get_history_manager)],
+):
+    await history_manager.delete_session(body.session_id, body.user_id)
+    return ApiResponse(data=body.session_id)
+
 @router.post(
     "/db_info",
     summary="获取知识库二级信息",
@@ -63,11 +76,21 @@ async def send_msg(
     service: Annotated[ChatService, Depends(get_chat_service)],
     history_manager: Annotated[HistoryManager, Depends(get_history_manager)],
 ):  
+    chat_history = None if body.server_history else body.chat_history
+    if body.stream:
+        # 回答落库放到响应结束后执行，不阻塞最后一个字节
+        events = await service.chat_stream(
+            body.user_id, body.session_id, body.text, body.audio, chat_history, body.selected_dbs
+        )
+        return StreamingResponse(
+            events,
+            media_type="text/event-stream",
+            background=BackgroundTask(service.save_stream_answer),
+        )
 
-    ans = await service.chat(body.user_id, body.session_id, body.text, body.audio, body.chat_history, body.selected_dbs)
+    ans = await service.chat(body.user_id, body.session_id, body.text, body.audio, chat_history, body.selected_dbs)
     res = AnswerRequest(session_id=body.session_id,text=ans,files=[],audio='',chat_history=[{}])
     return ApiResponse(data=res.model_dump())
-    # return StreamingResponse(service.chat(body.user_id, body.session_id, body.text, body.audio, body.chat_history, body.selected_dbs), media_type="text/event-stream")
 
 
 @router.post(
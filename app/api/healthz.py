@@ -1,4 +1,6 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Response
+
+from app.core.service import knowledge_service
 
 router = APIRouter()
 
@@ -6,3 +8,11 @@ router = APIRouter()
 @router.get("/healthz")
 def health():
     return "ok"
+
+
+@router.get("/readyz")
+def ready(response: Response):
+    if not knowledge_service.ready:
+        response.status_code = 503
+        return "loading"
+    return "ok"
@@ -0,0 +1,38 @@
+# 知识库管理
+
+import hmac
+import logging
+from typing import Annotated, Optional
+
+from fastapi import APIRouter, Header
+from utilswaves.schema import ApiResponse
+
+from app.config import settings
+from app.core.exception import BadRequest, Forbidden
+from app.core.service import knowledge_service
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/knowledge", tags=["knowledge"])
+
+
+def check_admin_token(token: Optional[str]):
+    # 未配置 token 时管理接口不可用
+    if not settings.knowledge.admin_token:
+        raise Forbidden("admin token not configured")
+    if not token or not hmac.compare_digest(token, settings.knowledge.admin_token):
+        raise Forbidden("invalid admin token")
+
+
+@router.post(
+    "/reload",
+    summary="热加载知识库",
+    response_model=ApiResponse[list[int]],
+)
+async def reload(x_admin_token: Annotated[Optional[str], Header()] = None):
+    check_admin_token(x_admin_token)
+    # 其他 worker 靠定期检查 redis 中的 reload 版本得知更新，不检查时只会刷新当前 worker
+    if settings.knowledge.reload_interval <= 0:
+        raise BadRequest("knowledge reload_interval is disabled")
+    changed = await knowledge_service.request_reload()
+    return ApiResponse(data=changed)
@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import logging.config
 from typing import Optional, Any
@@ -18,8 +19,14 @@ from utilswaves.schema import NAMESPACE
 
 from app import api
 from app.config import Settings, BASEDIR
+from app.core.client import ai_client
+from app.core.client.http import http_client
 from app.core.client.redis import redis_client
 from app.core.database.db.db import create_all
+from app.core.manager.message_writer import message_writer
+from app.core.service import knowledge_service
+from app.core.service.history_summary import history_summarizer
+from app.core.util import token_counter
 # from app.core.middleware.auth import AuthBackend, on_auth_error
 
 logger = logging.getLogger(__name__)
@@ -53,6 +60,9 @@ def create_app(app_settings: Settings, lifespan_manager: LifespanManager = None,
     # 注册外部服务
     register_client(app_settings)
 
+    # 注册启动/关闭钩子
+    register_lifespan(lifespan_manager, app_settings)
+
     # registry routers
     register_router(app)
 
@@ -117,12 +127,31 @@ def register_client(app_settings: Settings):
         app_settings.redis.url,
         prefix=f"{app_settings.app_name}:{app_settings.namespace}",
     )
+    http_client.configure(**app_settings.http.model_dump())
 
 
 def register_databases(lifespan_manager, app_settings: Settings):
     pass
 
 
+def register_lifespan(lifespan_manager: LifespanManager, app_settings: Settings):
+
+    @lifespan_manager.add
+    async def load_knowledge(app: FastAPI):
+        # 每个 worker 启动时在后台加载知识库，索引以 mmap 方式共享物理内存；加载完成前 /readyz 返回 503
+        logger.info("Load Knowledge ...")
+        if app_settings.chat.message_write_behind:
+            message_writer.start()
+        await asyncio.to_thread(lambda: token_counter.tokenizer)
+        knowledge_service.start()
+        yield
+        await knowledge_service.shutdown()
+        await history_summarizer.close()
+        await message_writer.close()
+        await http_client.close()
+        await ai_client.close_clients()
+
+
 def register_router(app):
     app.include_router(api.router)
     app.mount("/static", StaticFiles(directory=BASEDIR), name="static")
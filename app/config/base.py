@@ -48,6 +48,14 @@ class RedisSettings(BaseModel):
     url: str
 
 
+class HttpSettings(BaseModel):
+    limit: int = Field(default=100, description="连接池总连接数")
+    limit_per_host: int = Field(default=20, description="单 host 连接数上限")
+    timeout: float = Field(default=30.0, description="请求总超时（秒）")
+    retries: int = Field(default=3, description="失败重试次数")
+    backoff: float = Field(default=0.5, description="重试退避基数（秒）")
+
+
 class JWTSettings(BaseModel):
     secret: str
     lifetime_seconds: int = 60 * 60 * 2
@@ -62,7 +70,61 @@ class KnowledgeSettings(BaseModel):
     rerank_model: str
     embedding_url: str
     embedding_model: str
-
+    mmap_index: bool = Field(default=True, description="以 mmap 方式加载 faiss 索引，多 worker 共享内存")
+    max_resident_bytes: int = Field(default=8 << 30, description="单 worker 常驻索引的内存上限（字节）")
+    pinned: list[int] = Field(default=[6], description="启动时预加载且不会被淘汰的知识库")
+    reload_interval: int = Field(
+        default=30, description="每个 worker 检查知识库更新的间隔（秒），0 表示不检查，此时不能通过接口热加载"
+    )
+    admin_token: Optional[str] = Field(default=None, description="知识库管理接口的 token")
+    hybrid_search: bool = Field(default=False, description="向量检索与本地 BM25 关键词检索融合")
+    query_routing: bool = Field(default=False, description="按问题中的法规编号缩小或扩展检索的知识库")
+    search_workers: int = Field(default=4, description="faiss 检索线程数")
+    search_concurrency: int = Field(default=16, description="单 worker 同时进行的检索数上限")
+    rerank_cache_size: int = Field(default=1024, description="进程内 rerank 缓存条目数")
+    rerank_cache_ttl: int = Field(default=60 * 60, description="rerank 缓存过期时间（秒）")
+    rerank_cache_redis: bool = Field(default=False, description="rerank 结果是否同时缓存到 redis")
+    embedding_cache_size: int = Field(default=4096, description="进程内 query 向量缓存条目数")
+    embedding_cache_ttl: int = Field(default=60 * 60 * 24 * 7, description="redis 中 query 向量缓存过期时间（秒）")
+    embedding_cache_redis: bool = Field(default=False, description="query 向量是否同时缓存到 redis")
+
+
+
+class ChatSettings(BaseModel):
+    speculative_rag: bool = Field(default=False, description="多轮对话中检索与 is_need_rag 判断并行执行")
+    answer_cache: bool = Field(default=False, description="是否缓存首轮问答结果")
+    answer_cache_ttl: int = Field(default=60 * 60 * 24, description="答案缓存过期时间（秒）")
+    answer_cache_size: int = Field(default=256, description="每个检索范围保留的语义缓存条目数")
+    answer_cache_semantic: bool = Field(default=False, description="是否按问题向量相似度匹配缓存")
+    answer_cache_threshold: float = Field(default=0.95, description="语义缓存命中的相似度阈值")
+    tokenizer_path: Optional[str] = Field(
+        default="/opt/tokenizer/Qwen2.5-72B-Instruct/tokenizer.json",
+        description="tokenizer.json、模型目录或 huggingface 模型名，需与对话模型一致",
+    )
+    context_window: int = Field(default=32768, description="模型上下文长度（token）")
+    answer_tokens: int = Field(default=4096, description="为回答预留的 token 数")
+    history_tokens: int = Field(default=4096, description="对话历史最多占用的 token 数")
+    context_tokens: int = Field(default=12288, description="检索文档最多占用的 token 数")
+    doc_tokens: int = Field(default=4096, description="单篇检索文档最多占用的 token 数")
+    history_summary: bool = Field(default=False, description="较早的对话历史压缩为摘要")
+    history_turns: int = Field(default=3, description="原样保留的最近对话轮数")
+    history_summary_batch_turns: int = Field(default=2, description="累计多少轮未摘要的历史后更新摘要")
+    history_summary_ttl: int = Field(default=60 * 60 * 24, description="会话摘要过期时间（秒）")
+    summary_tokens: int = Field(default=1024, description="会话摘要最多占用的 token 数")
+    summary_input_tokens: int = Field(default=8192, description="单次生成摘要输入的对话 token 数上限，超出时分段合并")
+    server_history_size: int = Field(
+        default=20, description="服务端为每个会话保留的最近消息条数，超出 history_turns 的部分用于摘要对齐"
+    )
+    server_history_ttl: int = Field(default=60 * 60 * 24, description="服务端会话历史缓存过期时间（秒）")
+    message_write_behind: bool = Field(default=False, description="消息先入队，后台批量写入数据库")
+    message_batch_size: int = Field(default=100, description="单次批量写入的最大消息条数")
+    message_flush_interval: float = Field(default=0.2, description="消息入队后最长等待写入的时间（秒）")
+    message_queue_size: int = Field(default=10000, description="待写入消息队列长度上限，满时阻塞入队")
+    message_put_timeout: float = Field(default=1.0, description="队列满时入队等待的时间（秒），超时后直接写库")
+    message_close_timeout: float = Field(default=10.0, description="关闭时写完队列的最长时间（秒），需小于 gunicorn graceful_timeout")
+    session_cache_size: int = Field(default=10000, description="进程内会话缓存条目数")
+    session_cache_ttl: int = Field(default=60, description="进程内会话缓存过期时间（秒）")
+    session_cache_redis_ttl: int = Field(default=60 * 60 * 24, description="redis 会话缓存过期时间（秒）")
 
 
 class Settings(BaseSettings):
@@ -79,9 +141,11 @@ class Settings(BaseSettings):
     # xfyun: XfyunSettings
     openai: OpenAISettings
     knowledge: KnowledgeSettings
+    chat: ChatSettings = ChatSettings()
 
     mysql: MysqlSettings
     redis: RedisSettings
+    http: HttpSettings = HttpSettings()
 
     model_config = SettingsConfigDict(
         extra="ignore",
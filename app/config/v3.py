@@ -1,6 +1,8 @@
 from typing import List
 
+from app.config.base import settings
 from app.core.schema import MessageData
+from app.core.util import token_counter
 
 # DEFAULT_MODEL = "gemini-1.5-pro-latest"
 # DEFAULT_MODEL = "gemini-1.5-pro-latest"
@@ -12,7 +14,7 @@ DEFAULT_MODEL = "Qwen/Qwen2.5-72B-Instruct"
 
 
 
-def get_model_and_request_message_for_chat(chat_history: List[MessageData], context: str, query: str):
+def get_model_and_request_message_for_chat(chat_history: List[MessageData], context: str, query: str, summary: str = ""):
     prompt_template = """
 你是一个金牌合规律师，请基于<用户的问题>、根据当前问题<检索的文档>和之前的<对话历史>等信息来详细长文本有逻辑的解答用户的法律合规咨询。
 你是欧盟法律合规领域的专家，你检索到的文档多为英文文档，但你需要用中文对你的用户进行详细长文本有逻辑的回复，并且最后要加上你的总结。
@@ -29,12 +31,46 @@ def get_model_and_request_message_for_chat(chat_history: List[MessageData], cont
     """
     # ；如果你认为这个问题不具体太过于宽泛，可以适当对用户进行追问，用来确认它想要得到的答案是什么（但需要注意，如果用户多轮问题都在问相同的问题，那说明是你还不够智能）。
 
-    chat = ""
-    for message in chat_history:
-        chat += f"{message['role']}: {message['content']}\n"
-    
+    # 历史、检索文档与回答共用模型上下文：先扣除模板、问题和回答预留，历史取最近的若干条，剩余留给文档
+    budget = settings.chat.context_window - settings.chat.answer_tokens - token_counter.count(prompt_template + user_template + query)
+    chat = pack_history(chat_history, min(settings.chat.history_tokens, max(budget, 0)), summary)
+    context = token_counter.truncate(context, min(settings.chat.context_tokens, budget - token_counter.count(chat)))
+
     return DEFAULT_MODEL, [{"role": "system", "content": prompt_template}, {"role": "user", "content": user_template.format(chat_history=chat, query=query, context = context)}]
 
+
+def pack_history(chat_history: List[MessageData], max_tokens: int, summary: str = "") -> str:
+    """
+    摘要放在最前，消息从最近的往前取，直到超出 max_tokens
+    """
+    head = f"更早对话的摘要: {summary}\n" if summary else ""
+    lines = [f"{message['role']}: {message['content']}\n" for message in chat_history]
+    used = token_counter.count(head)
+    start = len(lines)
+    for tokens in reversed(token_counter.count_many(lines)):
+        if used + tokens > max_tokens:
+            break
+        used += tokens
+        start -= 1
+    return head + "".join(lines[start:])
+
+
+def get_model_and_request_message_for_summary(summary: str, chat_history: List[MessageData]):
+    prompt_template = """你是一个多轮对话系统中的助手，请把<已有摘要>和<新增对话>合并成一段新的摘要。
+摘要需要保留用户关心的法规、条款编号、车型/零部件、结论和尚未解决的问题，省略寒暄和重复内容，不超过500字，只输出摘要。
+"""
+    user_template = """<已有摘要>
+{summary}
+</已有摘要>
+
+<新增对话>
+{chat_history}
+</新增对话>
+"""
+    chat = "".join(f"{message['role']}: {message['content']}\n" for message in chat_history)
+    return DEFAULT_MODEL, [{"role": "system", "content": prompt_template}, {"role": "user", "content": user_template.format(summary=summary, chat_history=chat)}]
+
+
 def get_model_and_request_message_for_translation(source:str, target:str, text:str):
     prompt_template = f"""
                     你是一位精通各国语言的专业翻译，尤其擅长将法规文件翻译成浅显易懂的指定语言法规文章。请将<用户的文字>从{source}翻译成{target}专业的法规文章。
@@ -1,3 +1,4 @@
+import itertools
 import json
 import logging
 import re
@@ -14,21 +15,42 @@ with open(filepath) as config_file:
     model_keys: dict[str, dict] = json.load(config_file)
 
 
+# 进程内复用的客户端，同一 base_url/api_key 共享一个 httpx 连接池
+_clients: dict[tuple[str, str], openai.Client] = {}
+_cursors: dict[str, itertools.cycle] = {}
+
+
+def _get_or_create_client(api_key: str, base_url: str) -> openai.Client:
+    key = (base_url, api_key)
+    client = _clients.get(key)
+    if client is None:
+        client = _clients[key] = openai.Client(api_key=api_key, base_url=base_url)
+    return client
+
+
 def get_client(model):
     model_key = model_keys.get(model, None)
     if model_key:
-        model_key = model_key[0]
-        return openai.Client(
-            api_key=model_key["api_key"],
-            base_url=model_key["base_url"],
-        )
+        # 在该模型配置的所有 key 之间轮询
+        cursor = _cursors.get(model)
+        if cursor is None:
+            cursor = _cursors[model] = itertools.cycle(range(len(model_key)))
+        model_key = model_key[next(cursor)]
+        return _get_or_create_client(model_key["api_key"], model_key["base_url"])
     return None
 
 
+async def close_clients():
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.close()
+
+
 
-async def chat_stream(model, request_message):
+async def chat_stream(model, request_message, temperature=0.8, top_p=1):
     client = get_client(model)
-    async for text in client.chat_stream(model, request_message):
+    async for text in client.chat_stream(model, request_message, temperature, top_p):
         yield text
 
 
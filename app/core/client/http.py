@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import random
+from datetime import datetime
+from typing import Any, Optional
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+from prometheus_client import Counter, Histogram
+
+from app.core.exception import HttpClientError
+
+logger = logging.getLogger(__name__)
+
+HTTP_REQUEST_TOTAL = Counter(
+    name="http_client_request_total",
+    documentation="Total count of outgoing http requests",
+    labelnames=["func", "error"],
+)
+
+HTTP_REQUEST_DURATION_SECONDS = Histogram(
+    name="http_client_request_duration_seconds",
+    documentation="process duration of outgoing http requests",
+    labelnames=["func", "error"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0, float("inf")),
+)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class HttpClient:
+    """
+    进程内共享的 aiohttp 连接池，keep-alive 复用连接，失败时按带抖动的指数退避重试
+    session 在首次使用时于事件循环内创建，应用关闭时调用 close
+    """
+
+    def __init__(self):
+        self.limit = 100
+        self.limit_per_host = 20
+        self.timeout = 30.0
+        self.retries = 3
+        self.backoff = 0.5
+        self._session: Optional[ClientSession] = None
+
+    def configure(
+        self,
+        limit: int = 100,
+        limit_per_host: int = 20,
+        timeout: float = 30.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+
+    @property
+    def session(self) -> ClientSession:
+        if self._session is None or self._session.closed:
+            connector = TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host, keepalive_timeout=60)
+            self._session = ClientSession(connector=connector, timeout=ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def post_json(self, func: str, url: str, payload: Any, headers: dict = None) -> Any:
+        attempt = 0
+        while True:
+            start = datetime.now().timestamp()
+            err_name = ""
+            try:
+                async with self.session.post(url, json=payload, headers=headers) as response:
+                    if response.status == 200:
+                        return await response.json()
+                    err_name = f"HTTP{response.status}"
+                    text = await response.text()
+                    if response.status not in RETRY_STATUS or attempt >= self.retries:
+                        raise HttpClientError(f"Error Code {response.status}, {text}")
+            except (ClientError, asyncio.TimeoutError) as e:
+                err_name = type(e).__name__
+                logger.warning(f"{func} request error: {e!r}, {attempt=}")
+                if attempt >= self.retries:
+                    raise HttpClientError(f"{func} failed: {e!r}")
+            finally:
+                duration = datetime.now().timestamp() - start
+                HTTP_REQUEST_TOTAL.labels(func, err_name).inc()
+                HTTP_REQUEST_DURATION_SECONDS.labels(func, err_name).observe(duration)
+
+            # full jitter: 在 [0, backoff * 2^attempt] 间随机等待
+            await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+            attempt += 1
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+http_client = HttpClient()
@@ -1,23 +1,124 @@
-import math
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import List, Optional
+import asyncio
+import hashlib
+import logging
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Iterator, List, Optional
 
 import numpy as np
 import requests
 from langchain_core.embeddings import Embeddings
+from prometheus_client import Counter
 from app.config import settings
+from app.core.client.http import http_client
+from app.core.client.redis import redis_client
+from app.core.util import LRUCache
+
+logger = logging.getLogger(__name__)
 
 MAX_BATCHES = 16
 MAX_REQUEST_TOKENS = 200000
+MAX_WORKERS = 8
+# 同时在途的 batch 数，限制内存占用
+MAX_INFLIGHT = MAX_WORKERS * 2
+MAX_RETRIES = 3
+RETRY_BACKOFF = 1.0
+
+EMBEDDING_CACHE_TOTAL = Counter(
+    name="embedding_cache_total",
+    documentation="Total count of query embedding cache lookups",
+    labelnames=["result"],
+)
+
+
+def pack_batches(
+    texts: List[str], max_chars: int = MAX_REQUEST_TOKENS, max_size: int = MAX_BATCHES
+) -> Iterator[tuple[int, int]]:
+    """
+    按每条文本的实际长度装箱，返回连续区间 [start, end)
+    """
+    start, size = 0, 0
+    for i, text in enumerate(texts):
+        length = max(len(text), 1)
+        if i > start and (i - start >= max_size or size + length > max_chars):
+            yield start, i
+            start, size = i, 0
+        size += length
+    if start < len(texts):
+        yield start, len(texts)
+
+
+class EmbeddingCache:
+    """
+    query 向量缓存，key 为 (model, sha1(text))，向量统一存为 float32
+    内存层为 LRU，redis 层直接存 float32 的二进制
+    """
+
+    def __init__(self, maxsize: int = 4096, ttl: int = 60 * 60 * 24 * 7, use_redis: bool = False):
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self._local: LRUCache[np.ndarray] = LRUCache(maxsize)
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return f"embedding_cache:{model}:{hashlib.sha1(text.encode('utf-8')).hexdigest()}"
+
+    def get_local(self, key: str) -> Optional[np.ndarray]:
+        vector = self._local.get(key)
+        if vector is not None:
+            EMBEDDING_CACHE_TOTAL.labels("memory").inc()
+        return vector
+
+    def set_local(self, key: str, vector: np.ndarray):
+        self._local.set(key, vector)
+
+    async def get(self, key: str) -> Optional[np.ndarray]:
+        vector = self.get_local(key)
+        if vector is not None:
+            return vector
+        if self.use_redis:
+            try:
+                data = await redis_client.get(key)
+            except Exception as err:
+                logger.error(f"embedding_cache get error: {err}")
+                data = None
+            if data:
+                vector = np.frombuffer(data, dtype=np.float32)
+                self._local.set(key, vector)
+                EMBEDDING_CACHE_TOTAL.labels("redis").inc()
+                return vector
+        EMBEDDING_CACHE_TOTAL.labels("miss").inc()
+        return None
+
+    async def set(self, key: str, vector: np.ndarray):
+        self._local.set(key, vector)
+        if self.use_redis:
+            try:
+                await redis_client.set(key, vector.tobytes(), ex=self.ttl)
+            except Exception as err:
+                logger.error(f"embedding_cache set error: {err}")
 
 
 class JinaEmbeddings(Embeddings):
-    def __init__(self, url: str, api_key: str, model: str, cpu: Optional[bool] = False) -> None:
+    def __init__(
+        self, url: str, api_key: str, model: str, cpu: Optional[bool] = False, cache: Optional[EmbeddingCache] = None
+    ) -> None:
         super().__init__()
         self.url = url
         self.cpu = cpu
         self.api_key = api_key
         self.model = model
+        self.cache = cache
+        # 同步路径复用连接和线程池（离线建库时使用）
+        self._session = requests.Session()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="jina-embedding")
+        return self._executor
 
     def get_batch_embedding(self, batch_texts):
         headers = {
@@ -25,7 +126,7 @@ class JinaEmbeddings(Embeddings):
             "Content-Type": "application/json"
         }
         payload = {"input": batch_texts, "model": self.model, "encoding_format": "float"}
-        response = requests.request("POST", url=self.url, json=payload, headers=headers)
+        response = self._session.post(url=self.url, json=payload, headers=headers)
         if response.status_code == 200:
             response = response.json()
             return np.array([i['embedding'] for i in response['data']])
@@ -36,32 +137,115 @@ class JinaEmbeddings(Embeddings):
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         if self.cpu:
             payload = {"text": texts}
-            response = requests.post(self.url, json=payload)
+            response = self._session.post(self.url, json=payload)
             if response.status_code == 200:
                 return np.array(response.json())
             else:
                 raise ValueError(f"Error Code {response.status_code}, {response.text}")
         else:
-            length_per_batch = max([len(text) for text in texts])
-            num_batch = min(MAX_BATCHES, MAX_REQUEST_TOKENS // length_per_batch)
-            batches = math.ceil(len(texts) / num_batch)
-            _results = [None] * batches
-            with ThreadPoolExecutor(max_workers=8) as executor:
-                future_map = {
-                    executor.submit(
-                        self.get_batch_embedding,
-                        texts[i * num_batch : (i + 1) * num_batch],
-                    ): i
-                    for i in range(batches)
-                }
-                for future in as_completed(future_map):
-                    index = future_map[future]
-                    _results[index] = future.result()
-            results = np.concatenate(_results, axis=0)
-            return results
+            return self.embed_batches(texts)
+
+    def get_batch_embedding_with_retry(self, batch_texts) -> np.ndarray:
+        attempt = 0
+        while True:
+            try:
+                return np.asarray(self.get_batch_embedding(batch_texts), dtype=np.float32)
+            except (requests.RequestException, ValueError) as err:
+                if attempt >= MAX_RETRIES:
+                    raise
+                logger.warning(f"get_batch_embedding error: {err}, {attempt=}")
+                time.sleep(random.uniform(0, RETRY_BACKOFF * 2 ** attempt))
+                attempt += 1
+
+    def embed_batches(self, texts: List[str], out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        按长度装箱后并发请求，结果按区间写入预分配的 float32 数组（可以传入 np.memmap）
+        在途 batch 数不超过 MAX_INFLIGHT，失败的 batch 单独重试
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32) if out is None else out
+        batches = pack_batches(texts)
+        pending = {}
+
+        def submit():
+            for start, end in batches:
+                pending[self.executor.submit(self.get_batch_embedding_with_retry, texts[start:end])] = (start, end)
+                if len(pending) >= MAX_INFLIGHT:
+                    return
+
+        submit()
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    start, end = pending.pop(future)
+                    vectors = future.result()
+                    if out is None:
+                        out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+                    out[start:end] = vectors
+                submit()
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+        return out
 
     def embed_query(self, text: str) -> List[float]:
-        return self.embed_documents([text])[0]
+        if self.cache is None:
+            return self.embed_documents([text])[0]
+        key = self.cache.make_key(self.model, text)
+        vector = self.cache.get_local(key)
+        if vector is None:
+            vector = np.asarray(self.embed_documents([text])[0], dtype=np.float32)
+            self.cache.set_local(key, vector)
+        return vector
+
+    async def aget_batch_embedding(self, batch_texts):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        payload = {"input": batch_texts, "model": self.model, "encoding_format": "float"}
+        response = await http_client.post_json("jina.embedding", self.url, payload, headers)
+        return np.array([i['embedding'] for i in response['data']])
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        if self.cpu:
+            payload = {"text": texts}
+            return np.array(await http_client.post_json("jina.embedding", self.url, payload))
+        else:
+            semaphore = asyncio.Semaphore(MAX_INFLIGHT)
+            out = None
+
+            async def embed(start: int, end: int):
+                nonlocal out
+                async with semaphore:
+                    vectors = np.asarray(await self.aget_batch_embedding(texts[start:end]), dtype=np.float32)
+                if out is None:
+                    out = np.empty((len(texts), vectors.shape[1]), dtype=np.float32)
+                out[start:end] = vectors
+
+            await asyncio.gather(*[embed(start, end) for start, end in pack_batches(texts)])
+            return out if out is not None else np.zeros((0, 0), dtype=np.float32)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        if self.cache is None:
+            return (await self.aembed_documents([text]))[0]
+        key = self.cache.make_key(self.model, text)
+        vector = await self.cache.get(key)
+        if vector is None:
+            vector = np.asarray((await self.aembed_documents([text]))[0], dtype=np.float32)
+            await self.cache.set(key, vector)
+        return vector
 
 
-jina_embedding = JinaEmbeddings(url=settings.knowledge.embedding_url, api_key=settings.knowledge.api_key, model=settings.knowledge.embedding_model)
+jina_embedding = JinaEmbeddings(
+    url=settings.knowledge.embedding_url,
+    api_key=settings.knowledge.api_key,
+    model=settings.knowledge.embedding_model,
+    cache=EmbeddingCache(
+        settings.knowledge.embedding_cache_size,
+        settings.knowledge.embedding_cache_ttl,
+        settings.knowledge.embedding_cache_redis,
+    ),
+)
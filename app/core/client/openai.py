@@ -34,6 +34,9 @@ class Client:
     def __init__(self, api_key: str, base_url: str = None):
         self.client = AsyncOpenAI(api_key=api_key, base_url=base_url)
 
+    async def close(self):
+        await self.client.close()
+
     # def speech_to_text(self, audio_path: str) -> str:
     #     audio_file = open(audio_path, "rb")
     #     transcription = self.client.audio.transcriptions.create(
@@ -82,6 +85,8 @@ class Client:
         while retry < 3:
             start = datetime.now().timestamp()
             err_name = ""
+            first_token = True
+            response = ""
             try:
                 stream = await self.client.chat.completions.create(
                     model=model,
@@ -92,8 +97,6 @@ class Client:
                     top_p=top_p,
                     timeout=15,
                 )
-                first_token = True
-                response = ""
                 async for chunk in stream:
                     if not chunk.choices:
                         continue
@@ -112,10 +115,13 @@ class Client:
                         # logger.info(f"{chunk_response =} ")
                 return
 
-            except BaseException as e:
+            except Exception as e:
                 logger.error(f"An unexpected error occurred: {e}")
                 retry += 1
                 err_name = type(e).__name__
+                # 已经输出过内容时重试会从头重复输出，直接抛出
+                if response or retry >= 3:
+                    raise
             finally:
                 duration = datetime.now().timestamp() - start
                 logger.info(f"openai.chat_stream {duration = }")
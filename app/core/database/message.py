@@ -2,10 +2,11 @@ from typing import Annotated
 
 from fastapi import Depends
 from mysqlwaves import SqlDatabase
-from sqlalchemy import select, func, literal
+from sqlalchemy import select, func, literal, desc
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.database.db import get_session
+from app.core.enums import Role
 from app.core.model import Message, Session
 
 
@@ -70,6 +71,21 @@ class MessageDao(SqlDatabase[Message]):
 
         return total, items
 
+    async def list_recent(self, session_id: int, limit: int) -> list[dict]:
+        """
+        会话最近 limit 条问答消息，按时间正序
+        """
+        result = await self.session.execute(
+            select(Message.role, Message.content)
+            .where(
+                Message.session_id == session_id,
+                Message.role.in_([Role.USER.value, Role.ASSISTANT.value]),
+            )
+            .order_by(desc(Message.create_time), desc(Message.message_id))
+            .limit(limit)
+        )
+        return [dict(row._mapping) for row in reversed(result.fetchall())]
+
     async def update_feedback(
         self, user_id: int, message_id: int, feedback_type: int, feedback_content: str
     ) -> Message:
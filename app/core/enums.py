@@ -63,3 +63,10 @@ class TaskType(IntEnum):
 class TaskScoreType(IntEnum):
     MAX = 1
     LAST = 2
+
+
+class IndexType(StrEnum):
+    FLAT = "flat"
+    IVF_PQ = "ivf_pq"
+    HNSW = "hnsw"
+    SQ8 = "sq8"
@@ -13,6 +13,18 @@ class ServerException(FastAPIBaseException):
     MESSAGE = "Internal Server Error"
 
 
+class ServiceUnavailable(FastAPIBaseException):
+    CODE = 503
+    STATUS_CODE = 503
+    MESSAGE = "Service Unavailable"
+
+
+class Forbidden(FastAPIBaseException):
+    CODE = 403
+    STATUS_CODE = 403
+    MESSAGE = "Forbidden"
+
+
 class NoFound(FastAPIBaseException):
     CODE = 404
     MESSAGE = "Not Found"
@@ -65,3 +77,7 @@ class InsufficientDialogRounds(BadRequest):
 
 class VolcClientError(ServerException):
     CODE = 50001
+
+
+class HttpClientError(ServerException):
+    CODE = 50002
@@ -0,0 +1,5 @@
+from .executor import SearchExecutor
+from .manager import IndexManager
+from .store import KnowledgeStore, load_store, read_index, store_version
+
+__all__ = ["IndexManager", "KnowledgeStore", "SearchExecutor", "load_store", "read_index", "store_version"]
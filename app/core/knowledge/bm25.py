@@ -0,0 +1,104 @@
+import math
+import re
+from collections import Counter, defaultdict
+from typing import Iterable, List, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+TOKEN_RE = re.compile(r"[a-z0-9]+|[一-鿿]+")
+PART_RE = re.compile(r"[a-z]+|[0-9]+")
+
+# 纯法规编号类查询，如 R100、ECE R13、FMVSS 208、49 CFR Part 571、EU 2018/858
+IDENTIFIER_RE = re.compile(
+    r"^\s*(?:(?:ece\s*)?r\s*\d{1,3}"
+    r"|(?:fmvss|cmvss)\s*\d{3}"
+    r"|\d+\s*cfr(?:\s*part)?\s*\d+(?:\.\d+)?"
+    r"|(?:eu|ec|eec)\s*(?:no\.?\s*)?\d+/\d+)\s*$",
+    re.I,
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    英文/数字按词切分，字母数字混合的编号额外拆出数字部分（去掉前导 0），中文按 bigram 切分
+    """
+    tokens = []
+    for match in TOKEN_RE.finditer(text.lower()):
+        token = match.group()
+        if "一" <= token[0] <= "鿿":
+            tokens.extend(token[i : i + 2] for i in range(max(len(token) - 1, 1)))
+            continue
+        tokens.append(token)
+        parts = PART_RE.findall(token)
+        if len(parts) > 1:
+            tokens.extend(part.lstrip("0") or "0" if part.isdigit() else part for part in parts)
+    return tokens
+
+
+def is_identifier_query(query: str) -> bool:
+    return bool(IDENTIFIER_RE.match(query))
+
+
+class BM25Index:
+    """
+    内存倒排索引，postings 以 numpy 数组保存 (doc 下标, 词频)
+    """
+
+    def __init__(self, doc_ids: List[str], texts: Iterable[str], k1: float = 1.5, b: float = 0.75):
+        self.doc_ids = doc_ids
+        self.k1 = k1
+        self.b = b
+        postings = defaultdict(list)
+        lengths = []
+        for i, text in enumerate(texts):
+            tokens = tokenize(text)
+            lengths.append(len(tokens))
+            for token, tf in Counter(tokens).items():
+                postings[token].append((i, tf))
+        self.doc_len = np.asarray(lengths, dtype=np.float32)
+        self.avgdl = float(self.doc_len.mean()) if lengths else 0.0
+        self.postings = {
+            token: (np.fromiter((i for i, _ in items), dtype=np.int32), np.fromiter((tf for _, tf in items), dtype=np.float32))
+            for token, items in postings.items()
+        }
+
+    @property
+    def nbytes(self) -> int:
+        """
+        估算占用内存：postings 数组 + 词表（每个词及 dict 槽位约 100 字节）
+        """
+        arrays = sum(idx.nbytes + tf.nbytes for idx, tf in self.postings.values())
+        return int(self.doc_len.nbytes + arrays + 100 * len(self.postings))
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        n = len(self.doc_ids)
+        if not n:
+            return []
+        scores = np.zeros(n, dtype=np.float32)
+        for token in set(tokenize(query)):
+            posting = self.postings.get(token)
+            if posting is None:
+                continue
+            idx, tf = posting
+            idf = math.log(1 + (n - len(idx) + 0.5) / (len(idx) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[idx] / (self.avgdl or 1.0))
+            scores[idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.doc_ids[i], float(scores[i])) for i in top if scores[i] > 0]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int, c: int = 60) -> List[Document]:
+    """
+    RRF: score = sum(1 / (c + rank))，按 (knowledge_id, doc.id) 去重
+    """
+    scores = defaultdict(float)
+    docs = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = (doc.metadata.get("knowledge_id"), doc.id or doc.page_content)
+            scores[key] += 1.0 / (c + rank + 1)
+            docs.setdefault(key, doc)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)[:k]]
@@ -0,0 +1,81 @@
+"""
+把 FAISS.save_local 生成的 index.pkl 转换为紧凑的 sqlite docstore，并对比加载后的常驻内存
+
+python -m app.core.knowledge.convert [folder ...] [--report]
+不指定 folder 时转换 settings.knowledge.base_dir 下的所有知识库
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+
+from app.config import settings
+from app.core.knowledge.docstore import write_docstore
+from app.core.knowledge.store import DOCSTORE_FILE, load_store, read_pickle_docstore
+
+logger = logging.getLogger(__name__)
+
+
+def current_rss() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _measure(folder: str, compact: bool, queue):
+    from app.core.client.jina import jina_embedding
+
+    before = current_rss()
+    store = load_store(folder, jina_embedding, mmap=True, compact=compact)
+    # 触发一次原文读取，保证统计到实际常驻部分
+    for raw_id in list(store.raws)[:1]:
+        store.raws.get(raw_id)
+    queue.put(current_rss() - before)
+
+
+def measure_rss(folder: str, compact: bool) -> int:
+    """
+    在子进程中加载知识库，返回加载前后的 RSS 增量（字节）
+    """
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    process = ctx.Process(target=_measure, args=(folder, compact, queue))
+    process.start()
+    delta = queue.get()
+    process.join()
+    return delta
+
+
+def convert(folder: str):
+    docstore, index_to_docstore_id, raws = read_pickle_docstore(folder)
+    write_docstore(folder, docstore, index_to_docstore_id, raws)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="convert pickled FAISS docstores to compact sqlite docstores")
+    parser.add_argument("folders", nargs="*", help="knowledge folders, default: all under knowledge.base_dir")
+    parser.add_argument("--report", action="store_true", help="report RSS before/after conversion")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    folders = args.folders or sorted(
+        str(p.parent) for p in Path(settings.knowledge.base_dir).glob(f"*/{DOCSTORE_FILE}")
+    )
+    total_before = total_after = 0
+    for folder in folders:
+        before = measure_rss(folder, compact=False) if args.report else 0
+        convert(folder)
+        if args.report:
+            after = measure_rss(folder, compact=True)
+            total_before += before
+            total_after += after
+            print(f"{folder}: pickle {before / 2**20:.1f} MiB -> compact {after / 2**20:.1f} MiB")
+    if args.report and folders:
+        print(
+            f"total: {total_before / 2**20:.1f} MiB -> {total_after / 2**20:.1f} MiB "
+            f"({(1 - total_after / max(total_before, 1)) * 100:.1f}% reduction)"
+        )
+
+
+if __name__ == "__main__":
+    main()
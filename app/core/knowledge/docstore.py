@@ -0,0 +1,152 @@
+import json
+import logging
+import sqlite3
+import threading
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+logger = logging.getLogger(__name__)
+
+COMPACT_DOCSTORE_FILE = "docstore.sqlite"
+
+# 只读打开时映射到内存的上限，多 worker 共享 page cache
+MMAP_SIZE = 1 << 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sources (
+    source_id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS raws (
+    raw_id TEXT PRIMARY KEY,
+    text TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS chunks (
+    doc_id TEXT PRIMARY KEY,
+    faiss_id INTEGER NOT NULL UNIQUE,
+    content TEXT NOT NULL,
+    source_id INTEGER,
+    metadata TEXT NOT NULL
+);
+"""
+
+
+class SqliteConnection:
+    """
+    加载知识库时打开的只读连接，各检索线程加锁共用
+    连接持有打开时的文件，docstore.sqlite 被替换后仍读取与已加载索引对应的旧版本
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self.conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        self._lock = threading.Lock()
+
+    def fetchone(self, sql: str, params=()) -> Optional[tuple]:
+        with self._lock:
+            return self.conn.execute(sql, params).fetchone()
+
+    def fetchall(self, sql: str, params=()) -> list[tuple]:
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+
+class SqliteDocstore(Docstore):
+    """
+    按 doc_id 从 sqlite 中读取 chunk，source 路径只存一份
+    """
+
+    def __init__(self, conn: SqliteConnection, knowledge_id: int = 0):
+        self._conn = conn
+        self.knowledge_id = knowledge_id
+
+    def search(self, search: str) -> Union[str, Document]:
+        row = self._conn.fetchone(
+            "SELECT c.content, c.metadata, s.source FROM chunks c "
+            "LEFT JOIN sources s ON c.source_id = s.source_id WHERE c.doc_id = ?",
+            (search,),
+        )
+        if row is None:
+            return f"ID {search} not found."
+        content, metadata, source = row
+        metadata = json.loads(metadata)
+        metadata["knowledge_id"] = self.knowledge_id
+        if source is not None:
+            metadata["source"] = json.loads(source)
+        return Document(id=search, page_content=content, metadata=metadata)
+
+    def contents(self) -> dict[str, str]:
+        """
+        全部 chunk 文本，用于构建关键词索引
+        """
+        return dict(self._conn.fetchall("SELECT doc_id, content FROM chunks"))
+
+
+class SqliteRawStore(Mapping):
+    """
+    raw_id -> 原文
+    """
+
+    def __init__(self, conn: SqliteConnection):
+        self._conn = conn
+
+    def __getitem__(self, key: str) -> str:
+        row = self._conn.fetchone("SELECT text FROM raws WHERE raw_id = ?", (key,))
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def __iter__(self) -> Iterator[str]:
+        return (row[0] for row in self._conn.fetchall("SELECT raw_id FROM raws"))
+
+    def __len__(self) -> int:
+        return self._conn.fetchone("SELECT COUNT(*) FROM raws")[0]
+
+
+def read_docstore(folder: str, knowledge_id: int = 0) -> tuple[SqliteDocstore, dict[int, str], SqliteRawStore]:
+    conn = SqliteConnection(str(Path(folder).joinpath(COMPACT_DOCSTORE_FILE)))
+    index_to_docstore_id = {
+        faiss_id: doc_id for faiss_id, doc_id in conn.fetchall("SELECT faiss_id, doc_id FROM chunks")
+    }
+    return SqliteDocstore(conn, knowledge_id), index_to_docstore_id, SqliteRawStore(conn)
+
+
+def write_docstore(folder: str, docstore: Docstore, index_to_docstore_id: dict[int, str], raws: Mapping[str, str]):
+    """
+    把 (docstore, index_to_docstore_id, raws) 写成紧凑的 sqlite docstore
+    chunk metadata 需要已经过 intern_raw_texts 处理
+    """
+    path = Path(folder).joinpath(COMPACT_DOCSTORE_FILE)
+    tmp = path.with_suffix(".tmp")
+    tmp.unlink(missing_ok=True)
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.executescript(SCHEMA)
+        conn.executemany("INSERT INTO raws (raw_id, text) VALUES (?, ?)", raws.items())
+        sources: dict[str, int] = {}
+        rows = []
+        for faiss_id, doc_id in index_to_docstore_id.items():
+            doc = docstore.search(doc_id)
+            metadata = dict(doc.metadata)
+            metadata.pop("knowledge_id", None)
+            source_id = None
+            if "source" in metadata:
+                source = json.dumps(metadata.pop("source"), ensure_ascii=False)
+                source_id = sources.get(source)
+                if source_id is None:
+                    source_id = sources[source] = len(sources) + 1
+            rows.append((doc_id, int(faiss_id), doc.page_content, source_id, json.dumps(metadata, ensure_ascii=False)))
+        conn.executemany("INSERT INTO sources (source_id, source) VALUES (?, ?)", [(v, k) for k, v in sources.items()])
+        conn.executemany(
+            "INSERT INTO chunks (doc_id, faiss_id, content, source_id, metadata) VALUES (?, ?, ?, ?, ?)", rows
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    tmp.replace(path)
+    logger.info(f"write_docstore {path=}, chunks={len(rows)}, sources={len(sources)}, raws={len(raws)}")
@@ -0,0 +1,30 @@
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class SearchExecutor:
+    """
+    在独立线程池中执行 faiss 检索，避免阻塞事件循环；faiss 检索时会释放 GIL
+    max_concurrency 限制同时排队/执行的检索数量
+    """
+
+    def __init__(self, max_workers: int = 4, max_concurrency: int = 16):
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="faiss-search")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
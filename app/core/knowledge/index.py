@@ -0,0 +1,275 @@
+"""
+faiss 索引类型：flat / ivf_pq / hnsw / sq8
+
+python -m app.core.knowledge.index build FOLDER --type ivf_pq [--nlist N --pq-m M ...]
+    用 flat 索引中的向量重建为指定类型，参数写入 index.json，加载时应用检索参数；
+    flat 向量另存为 index.flat.faiss，供增量导入和再次重建使用
+python -m app.core.knowledge.index evaluate FOLDER QUERIES [--k 5] [--config JSON ...]
+    在 held-out query 上对比不同索引配置相对精确检索的 recall@k 和延迟
+"""
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+from typing import Optional
+
+import faiss
+import numpy as np
+from pydantic import BaseModel, Field
+
+from app.core.enums import IndexType
+
+logger = logging.getLogger(__name__)
+
+INDEX_PARAMS_FILE = "index.json"
+# 非 flat 索引旁保留一份 flat 索引作为原始向量，增量导入和重建都基于它
+FLAT_INDEX_FILE = "index.flat.faiss"
+
+
+class IndexParams(BaseModel):
+    index_type: IndexType = IndexType.FLAT
+    nlist: int = Field(default=1024, description="ivf 聚类中心数，向量数不足时自动减小")
+    pq_m: int = Field(default=16, description="pq 子空间数，需要整除向量维度")
+    pq_nbits: int = Field(default=8, description="pq 每个子空间的编码位数")
+    nprobe: int = Field(default=16, description="ivf 检索时访问的聚类数")
+    hnsw_m: int = Field(default=32, description="hnsw 每个节点的邻居数")
+    ef_construction: int = Field(default=200, description="hnsw 建图时的候选数")
+    ef_search: int = Field(default=64, description="hnsw 检索时的候选数")
+
+
+def build_index(vectors: np.ndarray, params: IndexParams) -> faiss.Index:
+    """
+    按 params 构建索引并按原顺序加入向量，保证 faiss id 与 docstore 的对应关系不变
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, d = vectors.shape
+    match params.index_type:
+        case IndexType.FLAT:
+            index = faiss.IndexFlatL2(d)
+        case IndexType.IVF_PQ:
+            # 每个聚类至少 39 个训练样本
+            nlist = max(1, min(params.nlist, n // 39))
+            index = faiss.IndexIVFPQ(faiss.IndexFlatL2(d), d, nlist, params.pq_m, params.pq_nbits)
+            index.train(vectors)
+        case IndexType.HNSW:
+            index = faiss.IndexHNSWFlat(d, params.hnsw_m)
+            index.hnsw.efConstruction = params.ef_construction
+        case IndexType.SQ8:
+            index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit)
+            index.train(vectors)
+        case _:
+            raise ValueError(f"unsupported index type {params.index_type}")
+    index.add(vectors)
+    apply_search_params(index, params)
+    return index
+
+
+def apply_search_params(index: faiss.Index, params: IndexParams):
+    """
+    按索引实际的类型设置检索参数，index.json 与索引文件不一致时不会出错
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        ivf.nprobe = params.nprobe
+    if isinstance(index, faiss.IndexHNSW):
+        index.hnsw.efSearch = params.ef_search
+
+
+def read_index_params(folder: str) -> Optional[IndexParams]:
+    path = Path(folder).joinpath(INDEX_PARAMS_FILE)
+    if not path.exists():
+        return None
+    return IndexParams.model_validate_json(path.read_text())
+
+
+def write_index_params(folder: str, params: IndexParams):
+    path = Path(folder)
+    tmp = path.joinpath(f"{INDEX_PARAMS_FILE}.tmp")
+    tmp.write_text(params.model_dump_json(indent=2))
+    tmp.replace(path.joinpath(INDEX_PARAMS_FILE))
+
+
+def write_index(folder: str, name: str, index: faiss.Index):
+    path = Path(folder)
+    tmp = path.joinpath(f"{name}.tmp")
+    faiss.write_index(index, str(tmp))
+    tmp.replace(path.joinpath(name))
+
+
+def read_flat_index(folder: str, index_file: str) -> faiss.Index:
+    """
+    读取原始向量所在的 flat 索引：优先 index.flat.faiss，其次 index_file（必须是 flat）
+    量化/图索引无法精确取回向量，也不能按 langchain 的方式删除向量
+    """
+    path = Path(folder).joinpath(FLAT_INDEX_FILE)
+    if not path.exists():
+        path = Path(folder).joinpath(index_file)
+    index = faiss.read_index(str(path))
+    if not isinstance(index, faiss.IndexFlat):
+        raise ValueError(f"{path} is not a flat index and {FLAT_INDEX_FILE} is missing, rebuild the store from documents")
+    return index
+
+
+def matches_params(index: faiss.Index, params: IndexParams) -> bool:
+    match params.index_type:
+        case IndexType.IVF_PQ:
+            return isinstance(faiss.try_extract_index_ivf(index), faiss.IndexIVFPQ)
+        case IndexType.HNSW:
+            return isinstance(index, faiss.IndexHNSW)
+        case IndexType.SQ8:
+            return isinstance(index, faiss.IndexScalarQuantizer)
+    return isinstance(index, faiss.IndexFlat)
+
+
+def update_index(
+    folder: str, index_file: str, flat: faiss.Index, params: IndexParams, appended_from: Optional[int] = None
+) -> faiss.Index:
+    """
+    增量更新对外检索的索引，沿用已有索引时不重新训练：
+    只追加了向量（appended_from 为追加前的向量数）时直接在原索引上 add 新向量；
+    有删除时 langchain 会重排 faiss id，ivf_pq / sq8 复用已训练的量化器清空后按新顺序重新 add，
+    hnsw 无法删除节点，只能重建
+    聚类中心不随增量更新，数据分布变化较大时用 build 命令重新训练
+    """
+    path = Path(folder).joinpath(index_file)
+    index = faiss.read_index(str(path)) if path.exists() else None
+    if index is None or index.d != flat.d or not matches_params(index, params) or not index.is_trained:
+        return build_index(reconstruct_vectors(flat), params)
+    if appended_from is not None and index.ntotal == appended_from:
+        if flat.ntotal > appended_from:
+            index.add(flat.reconstruct_n(appended_from, flat.ntotal - appended_from))
+        logger.info(f"update_index {folder=}, added {flat.ntotal - appended_from} vectors")
+    elif params.index_type in (IndexType.IVF_PQ, IndexType.SQ8):
+        index.reset()
+        index.add(reconstruct_vectors(flat))
+        logger.info(f"update_index {folder=}, re-added {flat.ntotal} vectors with the trained quantizer")
+    else:
+        return build_index(reconstruct_vectors(flat), params)
+    apply_search_params(index, params)
+    return index
+
+
+def write_serving_index(
+    folder: str,
+    index_file: str,
+    flat: faiss.Index,
+    appended_from: Optional[int] = None,
+    defer_rebuild: bool = False,
+    rebuild: bool = False,
+):
+    """
+    按 index.json 写入对外检索的索引：非 flat 时在已有索引上增量更新（见 update_index），rebuild 时重新训练，
+    并保存 flat 副本；defer_rebuild 时暂以 flat 索引对外检索，之后用 build 命令重建；
+    index.faiss 最后替换，热加载看到新版本时其他文件都已就绪
+    """
+    params = read_index_params(folder) or IndexParams()
+    if params.index_type == IndexType.FLAT:
+        write_index(folder, index_file, flat)
+        Path(folder).joinpath(FLAT_INDEX_FILE).unlink(missing_ok=True)
+        return
+    write_index(folder, FLAT_INDEX_FILE, flat)
+    if defer_rebuild:
+        logger.warning(f"{folder=} serves a flat index until `index build` is run")
+        write_index(folder, index_file, flat)
+        return
+    if rebuild:
+        index = build_index(reconstruct_vectors(flat), params)
+    else:
+        index = update_index(folder, index_file, flat, params, appended_from)
+    write_index(folder, index_file, index)
+
+
+def reconstruct_vectors(index: faiss.Index) -> np.ndarray:
+    """
+    从 flat 索引取出全部原始向量；量化索引只能取回近似值
+    """
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def exact_search(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    return index.search(queries, k)[1]
+
+
+def evaluate(vectors: np.ndarray, queries: np.ndarray, params: IndexParams, k: int, truth: np.ndarray) -> dict:
+    start = time.perf_counter()
+    index = build_index(vectors, params)
+    build_seconds = time.perf_counter() - start
+
+    latencies = []
+    hits = 0
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query[None, :], k)
+        latencies.append(time.perf_counter() - start)
+        hits += len(set(ids[0]) & set(truth[i]))
+    latencies = np.array(latencies) * 1000
+    return {
+        "config": params.model_dump(mode="json", exclude_defaults=True) or {"index_type": "flat"},
+        f"recall@{k}": hits / (len(queries) * k),
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "build_s": build_seconds,
+        "bytes": int(faiss.serialize_index(index).nbytes),
+    }
+
+
+def read_queries(path: str) -> list[str]:
+    queries = []
+    for line in Path(path).read_text(encoding="utf-8").splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        queries.append(json.loads(line)["query"] if line.startswith("{") else line)
+    return queries
+
+
+def main():
+    from app.core.client.jina import jina_embedding
+    from app.core.knowledge.store import INDEX_FILE
+
+    parser = argparse.ArgumentParser(description="build or evaluate faiss index types")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build = sub.add_parser("build", help="rebuild a flat knowledge index as another type")
+    build.add_argument("folder")
+    build.add_argument("--type", type=IndexType, default=IndexType.FLAT)
+    for name, field in IndexParams.model_fields.items():
+        if name != "index_type":
+            build.add_argument(f"--{name.replace('_', '-')}", type=int, default=field.default, help=field.description)
+
+    evaluate_parser = sub.add_parser("evaluate", help="recall vs latency on held-out queries")
+    evaluate_parser.add_argument("folder")
+    evaluate_parser.add_argument("queries", help="text file with one query per line, or jsonl with a query field")
+    evaluate_parser.add_argument("--k", type=int, default=5)
+    evaluate_parser.add_argument(
+        "--config", action="append", default=[], help='IndexParams as json, e.g. {"index_type": "hnsw", "ef_search": 32}'
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    flat = read_flat_index(args.folder, INDEX_FILE)
+    if args.command == "build":
+        params = IndexParams(
+            index_type=args.type,
+            **{name: getattr(args, name) for name in IndexParams.model_fields if name != "index_type"},
+        )
+        # 先写检索参数，再写索引文件
+        write_index_params(args.folder, params)
+        write_serving_index(args.folder, INDEX_FILE, flat, rebuild=True)
+        print(f"built {params.index_type} index with {flat.ntotal} vectors")
+    else:
+        queries = np.asarray(jina_embedding.embed_documents(read_queries(args.queries)), dtype=np.float32)
+        vectors = reconstruct_vectors(flat)
+        truth = exact_search(vectors, queries, args.k)
+        configs = [IndexParams.model_validate_json(c) for c in args.config] or [
+            IndexParams(index_type=index_type) for index_type in IndexType
+        ]
+        for config in configs:
+            print(json.dumps(evaluate(vectors, queries, config, args.k, truth), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""
+增量更新知识库：切分新文档，只对内容发生变化的 chunk 做 embedding，并在原 faiss 索引上增删向量
+
+python -m app.core.knowledge.ingest (--folder DIR | --knowledge-id ID) [--remove SOURCE ...] [--defer-rebuild] [FILE ...]
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+from collections import Counter
+from pathlib import Path
+from typing import Annotated, Iterable
+
+import faiss
+from fastapi import Depends
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from app.config import settings
+from app.core.database import KnowledgeDao, get_knowledge_dao
+from app.core.knowledge.store import INDEX_FILE, raw_id, read_writable_store, save_store
+from app.core.util.dependency_utils import injectable
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+
+
+def read_text(path: Path) -> str:
+    if path.suffix == ".docx":
+        import docx
+
+        return "\n".join(p.text for p in docx.Document(str(path)).paragraphs)
+    return path.read_text(encoding="utf-8")
+
+
+def chunk_id(source: str, content: str, occurrence: int) -> str:
+    h = hashlib.sha1()
+    for part in (source, content, str(occurrence)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def source_key(source) -> str:
+    # 旧知识库的 source 可能是字符串列表，与 query_and_rerank 中的 file_key 一致
+    return source if isinstance(source, str) else "".join(source)
+
+
+class Ingestor:
+    """
+    manifest 记录每个 source 当前的 chunk id（由 source、chunk 内容决定），
+    更新时只 embedding 新增的 chunk，删除消失的 chunk，未变化的 chunk 只更新 offset
+    """
+
+    def __init__(self, folder: str, embeddings: Embeddings, chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP):
+        self.folder = Path(folder)
+        self.embeddings = embeddings
+        self.splitter = RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size, chunk_overlap=chunk_overlap, add_start_index=True
+        )
+        manifest = self.folder.joinpath(MANIFEST_FILE)
+        self.manifest: dict[str, list[str]] = json.loads(manifest.read_text()) if manifest.exists() else {}
+        if self.folder.joinpath(INDEX_FILE).exists():
+            self.vectorstore, self.raws = read_writable_store(str(self.folder), embeddings)
+            self._seed_manifest()
+            # 导入前的向量数，只有追加时检索索引可以直接 add 新向量
+            self.base_ntotal = self.vectorstore.index.ntotal
+        else:
+            self.vectorstore, self.raws = None, {}
+            self.base_ntotal = None
+        self.stats = Counter()
+
+    def _seed_manifest(self):
+        """
+        离线构建的知识库没有 manifest（或只覆盖部分 source），按 docstore 中的 metadata["source"] 补齐，
+        否则这些 chunk 既不能删除，重新导入时也会和新 chunk 并存
+        """
+        known = {_id for ids in self.manifest.values() for _id in ids}
+        docstore = self.vectorstore.docstore._dict
+        for _id in self.vectorstore.index_to_docstore_id.values():
+            if _id in known or _id not in docstore:
+                continue
+            source = source_key(docstore[_id].metadata.get("source", ""))
+            self.manifest.setdefault(source, []).append(_id)
+
+    def _chunks(self, source: str, text: str) -> list[tuple[str, Document]]:
+        occurrences = Counter()
+        chunks = []
+        for doc in self.splitter.create_documents([text]):
+            occurrences[doc.page_content] += 1
+            _id = chunk_id(source, doc.page_content, occurrences[doc.page_content])
+            chunks.append((_id, doc))
+        return chunks
+
+    def _delete(self, ids: Iterable[str]):
+        ids = [i for i in ids if i in self.vectorstore.docstore._dict] if self.vectorstore else []
+        if ids:
+            self.vectorstore.delete(ids)
+        self.stats["removed"] += len(ids)
+
+    def _add(self, items: list[tuple[str, Document]]):
+        if not items:
+            return
+        texts = [doc.page_content for _, doc in items]
+        vectors = self.embeddings.embed_documents(texts)
+        if self.vectorstore is None:
+            self.vectorstore = FAISS(
+                embedding_function=self.embeddings,
+                index=faiss.IndexFlatL2(len(vectors[0])),
+                docstore=InMemoryDocstore(),
+                index_to_docstore_id={},
+            )
+        self.vectorstore.add_embeddings(
+            text_embeddings=list(zip(texts, vectors)),
+            metadatas=[doc.metadata for _, doc in items],
+            ids=[_id for _id, _ in items],
+        )
+        self.stats["added"] += len(items)
+
+    def upsert(self, source: str, text: str):
+        _raw_id = raw_id(text)
+        self.raws[_raw_id] = text
+        chunks = self._chunks(source, text)
+        old_ids = set(self.manifest.get(source, []))
+        new_ids = {_id for _id, _ in chunks}
+        self._delete(old_ids - new_ids)
+
+        docstore = self.vectorstore.docstore._dict if self.vectorstore else {}
+        added = []
+        for i, (_id, doc) in enumerate(chunks):
+            metadata = {
+                "source": source,
+                "raw_id": _raw_id,
+                "offset": doc.metadata["start_index"],
+                "prev_id": chunks[i - 1][0] if i > 0 else None,
+                "next_id": chunks[i + 1][0] if i + 1 < len(chunks) else None,
+            }
+            if _id in old_ids and _id in docstore:
+                docstore[_id].metadata.update(metadata)
+                self.stats["kept"] += 1
+            else:
+                added.append((_id, Document(page_content=doc.page_content, metadata=metadata)))
+        self._add(added)
+        self.manifest[source] = [_id for _id, _ in chunks]
+
+    def remove(self, source: str):
+        self._delete(self.manifest.pop(source, []))
+
+    def save(self, defer_rebuild: bool = False):
+        if self.vectorstore is None:
+            return
+        appended_from = self.base_ntotal if not self.stats["removed"] else None
+        save_store(str(self.folder), self.vectorstore, self.raws, appended_from, defer_rebuild)
+        tmp = self.folder.joinpath(f"{MANIFEST_FILE}.tmp")
+        tmp.write_text(json.dumps(self.manifest, ensure_ascii=False))
+        tmp.replace(self.folder.joinpath(MANIFEST_FILE))
+        logger.info(f"ingest {self.folder=}, {dict(self.stats)}")
+
+
+@injectable
+async def get_knowledge_folder(
+    knowledge_id: int,
+    knowledge_dao: Annotated[KnowledgeDao, Depends(get_knowledge_dao)],
+) -> str:
+    for item in await knowledge_dao.list():
+        if item.knowledge_id == knowledge_id:
+            return f"{settings.knowledge.base_dir}/{item.folder}"
+    raise ValueError(f"invalid knowledge_id {knowledge_id}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="incrementally update a FAISS knowledge store")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--folder", help="knowledge folder")
+    target.add_argument("--knowledge-id", type=int, help="knowledge id in t_knowledge")
+    parser.add_argument("--remove", nargs="*", default=[], help="sources to remove")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--chunk-overlap", type=int, default=CHUNK_OVERLAP)
+    parser.add_argument(
+        "--defer-rebuild",
+        action="store_true",
+        help="serve the flat index instead of rebuilding hnsw/ivf_pq/sq8; run `index build` later",
+    )
+    parser.add_argument("files", nargs="*", help="documents to add or update")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from app.core.client.jina import jina_embedding
+
+    folder = args.folder or asyncio.run(get_knowledge_folder(knowledge_id=args.knowledge_id))
+    ingestor = Ingestor(folder, jina_embedding, args.chunk_size, args.chunk_overlap)
+    for source in args.remove:
+        ingestor.remove(source)
+    for file in args.files:
+        ingestor.upsert(file, read_text(Path(file)))
+    ingestor.save(args.defer_rebuild)
+    print(dict(ingestor.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from typing import Iterable, Optional
+
+from langchain_core.embeddings import Embeddings
+from prometheus_client import Counter, Gauge, Histogram
+
+from app.core.knowledge.store import KnowledgeStore, load_store, store_version
+
+logger = logging.getLogger(__name__)
+
+KNOWLEDGE_LOAD_SECONDS = Histogram(
+    name="knowledge_load_seconds",
+    documentation="load duration of knowledge indexes",
+    labelnames=["knowledge_id"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, float("inf")),
+)
+
+KNOWLEDGE_RESIDENT_BYTES = Gauge(
+    name="knowledge_resident_bytes",
+    documentation="estimated bytes of resident knowledge indexes",
+    labelnames=["knowledge_id"],
+)
+
+KNOWLEDGE_EVICT_TOTAL = Counter(
+    name="knowledge_evict_total",
+    documentation="Total count of evicted knowledge indexes",
+    labelnames=["knowledge_id"],
+)
+
+
+class IndexManager:
+    """
+    知识库索引管理：首次使用时加载，按内存上限 LRU 淘汰，pinned 的知识库常驻
+    同一个知识库的并发加载通过 per-id 锁合并为一次
+    reload 在后台加载新版本后原子替换，旧版本在进行中的检索结束后释放
+    """
+
+    def __init__(
+        self,
+        base_dir: str,
+        embeddings: Embeddings,
+        mmap: bool = True,
+        max_bytes: int = 8 << 30,
+        pinned: Iterable[int] = (),
+    ):
+        self.base_dir = base_dir
+        self.embeddings = embeddings
+        self.mmap = mmap
+        self.max_bytes = max_bytes
+        self.pinned = set(pinned)
+        self.folders: dict[int, str] = {}
+        self._stores: OrderedDict[int, KnowledgeStore] = OrderedDict()
+        self._locks: defaultdict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._reload_lock = asyncio.Lock()
+        # 每次 reload 递增
+        self.generation = 0
+
+    def set_catalog(self, folders: dict[int, str]):
+        self.folders = dict(folders)
+
+    def __contains__(self, knowledge_id: int) -> bool:
+        return knowledge_id in self.folders
+
+    def __len__(self) -> int:
+        return len(self._stores)
+
+    @property
+    def resident_bytes(self) -> int:
+        return sum(store.nbytes for store in self._stores.values())
+
+    def get_loaded(self, knowledge_id: int) -> Optional[KnowledgeStore]:
+        return self._stores.get(knowledge_id)
+
+    async def get(self, knowledge_id: int) -> Optional[KnowledgeStore]:
+        """
+        返回已加载的知识库，未加载时加载；不在 catalog 中返回 None
+        """
+        store = self._stores.get(knowledge_id)
+        if store is not None:
+            self._stores.move_to_end(knowledge_id)
+            return store
+        if knowledge_id not in self.folders:
+            return None
+
+        async with self._locks[knowledge_id]:
+            store = self._stores.get(knowledge_id)
+            if store is not None:
+                return store
+            store = await self._load(knowledge_id)
+            self._stores[knowledge_id] = store
+            KNOWLEDGE_RESIDENT_BYTES.labels(knowledge_id).set(store.nbytes)
+            self._evict(keep=knowledge_id)
+        return store
+
+    async def preload(self, knowledge_ids: Iterable[int] = None):
+        knowledge_ids = self.pinned if knowledge_ids is None else knowledge_ids
+        await asyncio.gather(*[self.get(i) for i in knowledge_ids if i in self.folders])
+
+    async def reload(self, folders: dict[int, str] = None) -> list[int]:
+        """
+        更新 catalog 并重新加载文件版本或目录发生变化的常驻知识库，返回发生变化的知识库 id
+        """
+        async with self._reload_lock:
+            changed = []
+            if folders is not None:
+                for knowledge_id in set(self._stores) - set(folders):
+                    self._drop(knowledge_id)
+                    changed.append(knowledge_id)
+                self.folders = dict(folders)
+
+            for knowledge_id, store in list(self._stores.items()):
+                folder = self._folder(knowledge_id)
+                try:
+                    version = await asyncio.to_thread(store_version, folder)
+                except FileNotFoundError:
+                    logger.warning(f"reload knowledge {knowledge_id=}, {folder=} not found")
+                    continue
+                if folder == store.folder and version == store.version:
+                    continue
+                new_store = await self._load(knowledge_id)
+                # 加载期间可能已被淘汰，只替换仍然常驻的旧版本
+                if self._stores.get(knowledge_id) is store:
+                    self._stores[knowledge_id] = new_store
+                    KNOWLEDGE_RESIDENT_BYTES.labels(knowledge_id).set(new_store.nbytes)
+                changed.append(knowledge_id)
+
+            self.generation += 1
+            if changed:
+                logger.info(f"reload knowledge {self.generation=}, {changed=}")
+            return changed
+
+    def _folder(self, knowledge_id: int) -> str:
+        return f"{self.base_dir}/{self.folders[knowledge_id]}"
+
+    def _drop(self, knowledge_id: int):
+        self._stores.pop(knowledge_id, None)
+        KNOWLEDGE_RESIDENT_BYTES.remove(knowledge_id)
+
+    async def _load(self, knowledge_id: int) -> KnowledgeStore:
+        start = datetime.now().timestamp()
+        folder = self._folder(knowledge_id)
+        store = await asyncio.to_thread(self._load_store, folder, knowledge_id)
+        duration = datetime.now().timestamp() - start
+        KNOWLEDGE_LOAD_SECONDS.labels(knowledge_id).observe(duration)
+        logger.info(f"load knowledge {knowledge_id=}, {folder=}, {duration=:.2f}, {store.nbytes=}")
+        return store
+
+    def _load_store(self, folder: str, knowledge_id: int) -> KnowledgeStore:
+        """
+        在加载线程中同时构建关键词索引，检索线程池不承担整库分词
+        """
+        store = load_store(folder, self.embeddings, self.mmap, knowledge_id)
+        store.build_bm25()
+        return store
+
+    def _evict(self, keep: int):
+        for knowledge_id in list(self._stores):
+            if self.resident_bytes <= self.max_bytes:
+                break
+            if knowledge_id == keep or knowledge_id in self.pinned:
+                continue
+            # 正在进行的检索仍持有引用，结束后自然释放
+            self._drop(knowledge_id)
+            KNOWLEDGE_EVICT_TOTAL.labels(knowledge_id).inc()
+            logger.info(f"evict knowledge {knowledge_id=}")
+
+    def version(self, knowledge_id: int) -> str:
+        store = self._stores.get(knowledge_id)
+        return store.version if store else ""
@@ -0,0 +1,126 @@
+import re
+from typing import Container, Dict, List, Optional, Tuple
+
+from prometheus_client import Counter
+
+from app.config.db import DB, ECE
+
+QUERY_ROUTE_TOTAL = Counter(
+    name="query_route_total",
+    documentation="Total count of routed queries by action",
+    labelnames=["action"],
+)
+
+# 分类名称过短或过泛，不参与匹配
+SKIP_NAMES = {"Others", "TP"}
+
+US = DB["美国联邦(US-Federal)"]
+EU = DB["欧洲联盟（EC - European Union）"]
+
+# 精确的法规编号写法 -> 知识库 id；只有编号可以把检索扩展到未选择的知识库
+CODE_PATTERNS: Dict[str, int] = {
+    r"FMVSS\s*\d{3}": US["49 CFR Part 571 - FMVSS"],
+    r"49\s*CFR\s*(?:Part\s*)?571": US["49 CFR Part 571 - FMVSS"],
+    r"49\s*CFR\s*(?:Parts?\s*)?\d+": US["49 CFR Parts"],
+    r"40\s*CFR\s*(?:Parts?\s*)?\d+": US["40 CFR Parts"],
+    r"CCR\s*Title\s*13": US["加州排放（California Code of Regulations - Division 3）"],
+    r"\(EU\)\s*(?:No\.?\s*)?\d{2,4}/\d+|EU\s*\d{4}/\d+": EU["EU"],
+    r"\(EC\)\s*(?:No\.?\s*)?\d+/\d{4}|EC\s*No\.?\s*\d+/\d{4}": EU["EC"],
+}
+
+# 名称写法 -> 知识库 id；只用于在已选择的知识库中缩小范围
+NAME_PATTERNS: Dict[str, int] = {
+    r"California\s*Code\s*of\s*Regulations|加州": US["加州排放（California Code of Regulations - Division 3）"],
+    r"49\s*CFR": US["49 CFR Parts"],
+    r"40\s*CFR": US["40 CFR Parts"],
+}
+
+# ECE 法规编号：R100、r155、ECE R13、UN R 155、Regulation No. 48、第 48 号法规
+# 小写 r 后不允许空白，避免 "3 r 2" 之类的文本被当作法规编号
+ECE_PATTERN = (
+    r"(?:(?i:ECE|UN)\s*)?(?:R\s*|r)0*(?P<r>\d{1,3})(?!\d)"
+    r"|(?i:Regulation\s*No\.?)\s*0*(?P<no>\d{1,3})(?!\d)"
+    r"|第\s*0*(?P<zh>\d{1,3})\s*号法规"
+)
+
+
+class QueryRouter:
+    """
+    根据问题中的法规编号把检索路由到对应知识库
+    所有模式编译成一个正则，一次扫描完成匹配
+    """
+
+    def __init__(self):
+        self.ece_parent = DB["欧洲经济委员会（ECE - United Nations）"]["ECE"]
+        self.parents = {knowledge_id: self.ece_parent for knowledge_id in ECE.values()}
+        # (知识库 id, 是否为精确编号)
+        self.targets: List[Tuple[int, bool]] = []
+        patterns = [f"(?P<ece>{ECE_PATTERN})"]
+        for pattern, knowledge_id in CODE_PATTERNS.items():
+            patterns.append(f"(?P<t{len(self.targets)}>(?i:{pattern}))")
+            self.targets.append((knowledge_id, True))
+        names = {re.escape(name): knowledge_id for group in DB.values() for name, knowledge_id in group.items()}
+        names.update(NAME_PATTERNS)
+        for pattern in sorted(names, key=len, reverse=True):
+            if pattern not in SKIP_NAMES:
+                patterns.append(f"(?P<t{len(self.targets)}>(?i:{pattern}))")
+                self.targets.append((names[pattern], False))
+        self.pattern = re.compile(r"(?<![A-Za-z0-9])(?:" + "|".join(patterns) + r")(?![A-Za-z])")
+
+    def match(self, query: str) -> List[Tuple[int, bool]]:
+        """
+        返回问题中提到的 (知识库 id, 是否为精确编号)，同一知识库只保留一次，编号优先
+        """
+        matched: Dict[int, bool] = {}
+        for m in self.pattern.finditer(query):
+            if m.group("ece"):
+                number = m.group("r") or m.group("no") or m.group("zh")
+                code = ECE.get(f"R{int(number):03d}")
+                target = (code, True) if code else (self.ece_parent, False)
+            else:
+                name = next(key for key, value in m.groupdict().items() if value and key.startswith("t"))
+                target = self.targets[int(name[1:])]
+            knowledge_id, exact = target
+            matched[knowledge_id] = matched.get(knowledge_id, False) or exact
+        return list(matched.items())
+
+    def route(self, query: str, selected: List[int], available: Container[int]) -> List[int]:
+        """
+        问题中提到的法规落在选择范围内（本身或上级分类被选择）时，只检索这些法规；
+        精确编号即使不在选择范围内也检索，名称只用于缩小范围；都不适用时保持不变
+        """
+        routed: Dict[int, bool] = {}
+        for knowledge_id, exact in self.match(query):
+            # 单条法规没有独立知识库时回退到上级分类
+            if knowledge_id not in available:
+                knowledge_id = self.parents.get(knowledge_id)
+            if knowledge_id is not None and knowledge_id in available:
+                routed[knowledge_id] = routed.get(knowledge_id, False) or exact
+
+        # 已经点名具体法规时不再检索其上级分类
+        for knowledge_id in [self.parents.get(i) for i in routed]:
+            routed.pop(knowledge_id, None)
+
+        result = []
+        inside = False
+        for knowledge_id, exact in routed.items():
+            if knowledge_id in selected or self.parents.get(knowledge_id) in selected:
+                result.append(knowledge_id)
+                inside = True
+            elif exact:
+                result.append(knowledge_id)
+        if not result:
+            QUERY_ROUTE_TOTAL.labels("none").inc()
+            return selected
+        QUERY_ROUTE_TOTAL.labels("narrow" if inside else "expand").inc()
+        return result
+
+
+_router: Optional[QueryRouter] = None
+
+
+def get_query_router() -> QueryRouter:
+    global _router
+    if _router is None:
+        _router = QueryRouter()
+    return _router
@@ -0,0 +1,271 @@
+import hashlib
+import logging
+import pickle
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import List, Mapping, Optional, Tuple
+
+import faiss
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from app.core.knowledge.bm25 import BM25Index
+from app.core.knowledge.docstore import COMPACT_DOCSTORE_FILE, SqliteDocstore, read_docstore, write_docstore
+from app.core.knowledge.index import FLAT_INDEX_FILE, apply_search_params, read_flat_index, read_index_params, write_serving_index
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "index.pkl"
+
+# IO_FLAG_MMAP_IFC 才能把 flat 索引的向量也 mmap 进来，老版本 faiss 只有 IO_FLAG_MMAP
+MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+# chunk metadata 中保存全文的字段，转换后替换为 <key>_id
+RAW_KEYS = ("raw", "ammend")
+
+# 上下文扩展窗口（字符数）
+HEAD_CHARS = 1000
+BEFORE_CHARS = 1000
+AFTER_CHARS = 3000
+AMMEND_CHARS = 4000
+
+
+class KnowledgeStore:
+    """
+    单个知识库：faiss 向量库 + 按 id 存储一次的原文
+    chunk metadata 中只保留 raw_id / offset，上下文扩展直接切片
+    """
+
+    def __init__(
+        self,
+        knowledge_id: int,
+        vectorstore: FAISS,
+        raws: Mapping[str, str],
+        version: str,
+        nbytes: int = 0,
+        folder: str = "",
+    ):
+        self.knowledge_id = knowledge_id
+        self.vectorstore = vectorstore
+        self.raws = raws
+        self.version = version
+        self.folder = folder
+        # 以磁盘文件大小估算占用内存
+        self.nbytes = nbytes
+        self._bm25: Optional[BM25Index] = None
+        self._bm25_lock = threading.Lock()
+
+    def search(self, embedding, k: int) -> List[Tuple[Document, float]]:
+        """
+        返回 (doc, score)，score 越大越相关
+        """
+        docs = self.vectorstore.similarity_search_with_score_by_vector(embedding, k)
+        # 欧氏距离越小越相关，统一取负数
+        sign = -1 if self.vectorstore.distance_strategy == DistanceStrategy.EUCLIDEAN_DISTANCE else 1
+        return [(doc, sign * float(score)) for doc, score in docs]
+
+    def build_bm25(self):
+        """
+        构建关键词索引并计入占用内存，由 IndexManager 在加载线程中调用
+        """
+        doc_ids = list(self.vectorstore.index_to_docstore_id.values())
+        contents = chunk_contents(self.vectorstore.docstore)
+        bm25 = BM25Index(doc_ids, (contents.get(doc_id, "") for doc_id in doc_ids))
+        self._bm25 = bm25
+        self.nbytes += bm25.nbytes
+
+    @property
+    def bm25(self) -> BM25Index:
+        """
+        未经 IndexManager 加载的知识库（如离线脚本）在首次使用时构建
+        """
+        if self._bm25 is None:
+            with self._bm25_lock:
+                if self._bm25 is None:
+                    self.build_bm25()
+        return self._bm25
+
+    def keyword_search(self, query: str, k: int) -> List[Tuple[Document, float]]:
+        return [(self.vectorstore.docstore.search(doc_id), score) for doc_id, score in self.bm25.search(query, k)]
+
+    def expand(self, doc: Document) -> str:
+        """
+        取 chunk 所在原文的开头以及 chunk 前后窗口，附加修订内容
+        """
+        metadata = doc.metadata
+        raw = self.raws.get(metadata.get("raw_id"))
+        offset = metadata.get("offset", -1)
+        if raw is None or offset < 0:
+            page_content = doc.page_content
+        elif offset > HEAD_CHARS:
+            page_content = raw[:HEAD_CHARS] + raw[offset - BEFORE_CHARS : offset + AFTER_CHARS]
+        else:
+            page_content = raw[: offset + BEFORE_CHARS + AFTER_CHARS]
+        ammend = self.raws.get(metadata.get("ammend_id"))
+        if ammend:
+            page_content += ammend[:AMMEND_CHARS]
+        return page_content
+
+
+def chunk_contents(docstore) -> Mapping[str, str]:
+    """
+    doc_id -> chunk 文本，sqlite docstore 一次查询读出
+    """
+    if isinstance(docstore, SqliteDocstore):
+        return docstore.contents()
+    return {doc_id: doc.page_content for doc_id, doc in docstore._dict.items()}
+
+
+def raw_id(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def intern_raw_texts(docstore: InMemoryDocstore, knowledge_id: int) -> dict[str, str]:
+    """
+    把每个 chunk metadata 中的 raw/ammend 全文抽出来只存一份，
+    chunk 中改为记录 raw_id、在原文中的 offset 以及同一原文的前后 chunk id
+    """
+    raws: dict[str, str] = {}
+    chunks = defaultdict(list)
+    for doc_id, doc in docstore._dict.items():
+        doc.id = doc_id
+        metadata = doc.metadata
+        metadata["knowledge_id"] = knowledge_id
+        for key in RAW_KEYS:
+            text = metadata.pop(key, None)
+            if text is None:
+                continue
+            _id = raw_id(text)
+            raws.setdefault(_id, text)
+            metadata[f"{key}_id"] = _id
+        if "raw_id" in metadata and "offset" not in metadata:
+            metadata["offset"] = raws[metadata["raw_id"]].find(doc.page_content)
+        if metadata.get("offset", -1) >= 0:
+            chunks[metadata["raw_id"]].append((metadata["offset"], doc_id))
+
+    for items in chunks.values():
+        items.sort()
+        for i, (_, doc_id) in enumerate(items):
+            metadata = docstore._dict[doc_id].metadata
+            metadata["prev_id"] = items[i - 1][1] if i > 0 else None
+            metadata["next_id"] = items[i + 1][1] if i + 1 < len(items) else None
+    return raws
+
+
+def read_index(folder: str, mmap: bool = True) -> faiss.Index:
+    """
+    读取 faiss 原始索引文件，mmap 模式下各 worker 共享同一份 page cache
+    """
+    path = str(Path(folder).joinpath(INDEX_FILE))
+    index = faiss.read_index(path, MMAP_FLAGS) if mmap else faiss.read_index(path)
+    # 非 flat 索引按 index.json 设置检索参数
+    params = read_index_params(folder)
+    if params:
+        apply_search_params(index, params)
+    return index
+
+
+def read_pickle_docstore(folder: str, knowledge_id: int = 0) -> tuple[InMemoryDocstore, dict[int, str], dict[str, str]]:
+    with open(Path(folder).joinpath(DOCSTORE_FILE), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    raws = intern_raw_texts(docstore, knowledge_id)
+    return docstore, index_to_docstore_id, raws
+
+
+def load_store(
+    folder: str, embeddings: Embeddings, mmap: bool = True, knowledge_id: int = 0, compact: bool = True
+) -> KnowledgeStore:
+    """
+    加载知识库目录，优先使用紧凑的 sqlite docstore，没有时回退到 FAISS.save_local 生成的 index.pkl
+    """
+    version = store_version(folder)
+    index = read_index(folder, mmap)
+    if compact and Path(folder).joinpath(COMPACT_DOCSTORE_FILE).exists():
+        docstore, index_to_docstore_id, raws = read_docstore(folder, knowledge_id)
+    else:
+        docstore, index_to_docstore_id, raws = read_pickle_docstore(folder, knowledge_id)
+    logger.info(f"load_store {folder=}, {index.ntotal=}, {len(raws)=}, {mmap=}, {type(docstore).__name__}")
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
+    nbytes = sum(p.stat().st_size for p in Path(folder).iterdir() if p.is_file() and p.name != FLAT_INDEX_FILE)
+    return KnowledgeStore(knowledge_id, vectorstore, raws, version, nbytes, folder)
+
+
+def read_writable_store(folder: str, embeddings: Embeddings) -> tuple[FAISS, dict[str, str]]:
+    """
+    以可写方式加载知识库（不 mmap，docstore 为 InMemoryDocstore），用于离线更新
+    非 flat 知识库在 index.flat.faiss 上更新，保存时按 index.json 重建
+    """
+    index = read_flat_index(folder, INDEX_FILE)
+    if Path(folder).joinpath(DOCSTORE_FILE).exists():
+        docstore, index_to_docstore_id, raws = read_pickle_docstore(folder)
+    else:
+        sqlite_docstore, index_to_docstore_id, sqlite_raws = read_docstore(folder)
+        docstore = InMemoryDocstore({doc_id: sqlite_docstore.search(doc_id) for doc_id in index_to_docstore_id.values()})
+        raws = dict(sqlite_raws)
+    vectorstore = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
+    return vectorstore, raws
+
+
+def save_store(
+    folder: str,
+    vectorstore: FAISS,
+    raws: Mapping[str, str],
+    appended_from: Optional[int] = None,
+    defer_rebuild: bool = False,
+):
+    """
+    写入 index.pkl、紧凑 docstore 和 index.faiss；先写临时文件再替换，
+    已经 mmap 旧文件的 worker 不受影响，热加载会检测到新版本
+    appended_from / defer_rebuild 见 write_serving_index
+    """
+    path = Path(folder)
+    path.mkdir(parents=True, exist_ok=True)
+    docstore: InMemoryDocstore = vectorstore.docstore
+    referenced = set()
+    for doc in docstore._dict.values():
+        metadata = doc.metadata
+        metadata.pop("knowledge_id", None)
+        referenced.update(metadata.get(f"{key}_id") for key in RAW_KEYS)
+    raws = {raw_id: text for raw_id, text in raws.items() if raw_id in referenced}
+
+    # index.pkl 保持 FAISS.save_local 的格式，原文按引用写回，pickle 对同一对象只存一份
+    pickled = InMemoryDocstore()
+    for doc_id, doc in docstore._dict.items():
+        metadata = dict(doc.metadata)
+        for key in RAW_KEYS:
+            _id = metadata.pop(f"{key}_id", None)
+            if _id in raws:
+                metadata[key] = raws[_id]
+        pickled._dict[doc_id] = Document(page_content=doc.page_content, metadata=metadata)
+    tmp = path.joinpath(f"{DOCSTORE_FILE}.tmp")
+    with open(tmp, "wb") as f:
+        pickle.dump((pickled, vectorstore.index_to_docstore_id), f)
+    tmp.replace(path.joinpath(DOCSTORE_FILE))
+
+    write_docstore(folder, docstore, vectorstore.index_to_docstore_id, raws)
+
+    # 版本由 index.faiss 决定，最后替换：docstore 就绪后 watcher 才会看到新版本
+    write_serving_index(folder, INDEX_FILE, vectorstore.index, appended_from, defer_rebuild)
+
+
+def store_version(folder: str) -> str:
+    """
+    以索引文件的修改时间和大小作为知识库版本
+    """
+    stat = Path(folder).joinpath(INDEX_FILE).stat()
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
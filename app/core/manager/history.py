@@ -6,7 +6,11 @@ from sqlalchemy import desc
 from app.core.database import SessionDao, MessageDao, get_session_dao, get_message_dao, UserDao, get_user_dao
 from app.core.enums import Role, SessionType, FeedbackType, TaskScoreType
 from app.core.exception import SessionNoFound, MessageNoFound
+from app.core.manager.history_cache import history_cache
+from app.core.manager.message_writer import message_writer
+from app.core.manager.session_cache import session_cache
 from app.core.model import Session, Message
+from app.core.schema import Session as SessionData
 
 
 class HistoryManager:
@@ -17,12 +21,15 @@ class HistoryManager:
         self.user_dao = user_dao
 
     async def create_chat_session(self, user_id: int) -> Session:
-        return await self.session_dao.create(
+        sess = await self.session_dao.create(
             Session(
                 user_id=user_id,
                 session_type=SessionType.CHAT.value,
             ).model_dump()
         )
+        await history_cache.set(sess.session_id, [])
+        await session_cache.set(sess)
+        return sess
 
     async def create_exercise_session(
         self,
@@ -64,23 +71,39 @@ class HistoryManager:
         )
 
     async def create_message(self, session_id: int, user_id: int, role: Role, content: str) -> None:
-        await self.message_dao.create(
-            Message(
-                session_id=session_id,
-                user_id=user_id,
-                role=role.value,
-                content=content,
-            ).model_dump()
-        )
+        if not await message_writer.put(session_id, user_id, role.value, content):
+            await self.message_dao.create(
+                Message(
+                    session_id=session_id,
+                    user_id=user_id,
+                    role=role.value,
+                    content=content,
+                ).model_dump()
+            )
+        if role in (Role.USER, Role.ASSISTANT):
+            await history_cache.append(session_id, {"role": role.value, "content": content})
+
+    async def get_chat_history(self, session_id: int, limit: int) -> list:
+        """
+        会话最近的问答消息，优先读 redis，未命中时从数据库加载并回填
+        """
+        messages = await history_cache.get(session_id)
+        if messages is None:
+            messages = await self.message_dao.list_recent(session_id, limit)
+            await history_cache.set(session_id, messages)
+        return messages[-limit:]
 
     async def update_first_message_in_session(self, session_id: int, content: str) -> None:
         await self.session_dao.update_first_message(session_id, content)
+        await session_cache.delete(session_id)
 
     async def update_last_message_in_session(self, session_id: int, content: str) -> None:
         await self.session_dao.update_last_message(session_id, content)
+        await session_cache.delete(session_id)
 
     async def update_score_in_session(self, session_id: int, score: int) -> None:
         await self.session_dao.update_score(session_id, score)
+        await session_cache.delete(session_id)
 
     async def list_session(
         self,
@@ -138,12 +161,24 @@ class HistoryManager:
             },
         )
 
-    async def get_session_by_id(self, session_id: int, user_id: int) -> Session:
-        sess = await self.session_dao.get(session_id)
-        if not sess or sess.user_id != user_id:
+    async def get_session_by_id(self, session_id: int, user_id: int) -> SessionData:
+        sess = await session_cache.get(session_id)
+        if sess is None:
+            row = await self.session_dao.get(session_id)
+            if row:
+                sess = await session_cache.set(row) or SessionData.model_validate(row)
+        if not sess or sess.deleted or sess.user_id != user_id:
             raise SessionNoFound()
         return sess
 
+    async def delete_session(self, session_id: int, user_id: int) -> None:
+        sess = await self.session_dao.get(session_id)
+        if not sess or sess.deleted or sess.user_id != user_id:
+            raise SessionNoFound()
+        await self.session_dao.update(sess, {"deleted": True})
+        await session_cache.delete(session_id)
+        await history_cache.delete(session_id)
+
     async def list_task_score(self, task_id: int, score_type: TaskScoreType, offset: int = 0, page_size: int = 20):
         total, score_dict = await self.session_dao.group_score_by_user(task_id, score_type, offset, page_size)
         user_ids = list(score_dict.keys())
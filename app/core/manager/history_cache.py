@@ -0,0 +1,69 @@
+import json
+import logging
+import uuid
+from typing import List, Optional
+
+from app.config import settings
+from app.core.client.redis import redis_client
+from app.core.schema import MessageData
+
+logger = logging.getLogger(__name__)
+
+# redis 不能保存空列表，用空字符串占位表示缓存存在
+MARKER = ""
+
+
+class HistoryCache:
+    """
+    每个会话最近的消息以 redis 列表缓存，create_message 时用 RPUSHX/LTRIM 写穿
+    """
+
+    def __init__(self, max_messages: int = 20, ttl: int = 60 * 60 * 24):
+        self.max_messages = max_messages
+        self.ttl = ttl
+
+    @staticmethod
+    def key(session_id: int) -> str:
+        return f"chat_history_list_{session_id}"
+
+    async def get(self, session_id: int) -> Optional[List[MessageData]]:
+        try:
+            items = await redis_client.lrange(self.key(session_id), 0, -1)
+            if not items:
+                return None
+            return [json.loads(item) for item in items if item not in (MARKER, MARKER.encode())]
+        except Exception as err:
+            logger.error(f"history cache get error: {err}")
+            return None
+
+    async def set(self, session_id: int, messages: List[MessageData]):
+        messages = messages[-self.max_messages:]
+        key = self.key(session_id)
+        # 先写临时 key 再 RENAME 覆盖，读取方不会看到缓存短暂消失
+        tmp = f"{key}_tmp_{uuid.uuid4().hex}"
+        try:
+            await redis_client.delete(tmp)
+            await redis_client.rpush(tmp, MARKER, *[json.dumps(m, ensure_ascii=False) for m in messages])
+            await redis_client.expire(tmp, self.ttl)
+            await redis_client.rename(tmp, key)
+        except Exception as err:
+            logger.error(f"history cache set error: {err}")
+
+    async def delete(self, session_id: int):
+        try:
+            await redis_client.delete(self.key(session_id))
+        except Exception as err:
+            logger.error(f"history cache delete error: {err}")
+
+    async def append(self, session_id: int, message: MessageData):
+        # 缓存不存在时不创建，避免只含部分历史的列表；下次读取从数据库加载
+        key = self.key(session_id)
+        try:
+            if await redis_client.rpushx(key, json.dumps(message, ensure_ascii=False)):
+                await redis_client.ltrim(key, -self.max_messages, -1)
+                await redis_client.expire(key, self.ttl)
+        except Exception as err:
+            logger.error(f"history cache append error: {err}")
+
+
+history_cache = HistoryCache(settings.chat.server_history_size, settings.chat.server_history_ttl)
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+from sqlalchemy import insert, text
+
+from app.config import settings
+from app.core.database import MessageDao
+from app.core.database.db import get_session
+from app.core.model import Message
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_QUEUE_DEPTH = Gauge(
+    name="message_queue_depth",
+    documentation="number of messages waiting to be written",
+)
+
+MESSAGE_FLUSH_SECONDS = Histogram(
+    name="message_flush_seconds",
+    documentation="duration of batched message inserts",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, float("inf")),
+)
+
+MESSAGE_FLUSH_TOTAL = Counter(
+    name="message_flush_total",
+    documentation="Total count of flushed messages by result",
+    labelnames=["result"],
+)
+
+
+class MessageWriter:
+    """
+    消息写入队列：多个请求的消息攒批后用一条多行 INSERT 落库，响应路径不再等待 MySQL
+    达到 batch_size 条或距第一条入队超过 flush_interval 秒时写入；close 时在 close_timeout 内写完队列中剩余的消息
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 100,
+        flush_interval: float = 0.2,
+        max_size: int = 10000,
+        retries: int = 3,
+        put_timeout: float = 1.0,
+        close_timeout: float = 10.0,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.retries = retries
+        self.put_timeout = put_timeout
+        self.close_timeout = close_timeout
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done() and not self._closing
+
+    def start(self):
+        if self.running:
+            return
+        self._closing = False
+        self._queue = asyncio.Queue(self.max_size)
+        self._task = asyncio.create_task(self._run())
+
+    async def put(self, session_id: int, user_id: int, role: str, content: str) -> bool:
+        """
+        入队成功返回 True；队列未运行（未启动或已关闭）或队列满且 put_timeout 内没有空位时返回 False，
+        由调用方直接写库，数据库不可用时请求和之前一样直接失败
+        """
+        if not self.running:
+            return False
+        now = datetime.now()
+        row = {
+            "session_id": session_id,
+            "user_id": user_id,
+            "role": role,
+            "content": content,
+            "create_time": now,
+            "update_time": now,
+        }
+        try:
+            await asyncio.wait_for(self._queue.put(row), self.put_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"message queue full, write session {session_id} directly")
+            return False
+        MESSAGE_QUEUE_DEPTH.set(self._queue.qsize())
+        return True
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stop = False
+        while not stop:
+            row = await self._queue.get()
+            if row is None:
+                break
+            rows = [row]
+            deadline = loop.time() + self.flush_interval
+            while len(rows) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    row = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if row is None:
+                    stop = True
+                    break
+                rows.append(row)
+            MESSAGE_QUEUE_DEPTH.set(self._queue.qsize())
+            await self._flush(rows)
+
+    async def _flush(self, rows: List[dict]):
+        """
+        批量写入失败后检查数据库连接：连接不可用视为故障，退避后重试（队列满时入队方改为直接写库）；
+        连接正常说明是消息本身的问题，逐条写入，写不进去的记录后丢弃，不阻塞后续消息
+        """
+        delay = 0.5
+        while not await self._insert_batch(rows):
+            if await self._healthy():
+                failed = await self._insert_rows(rows)
+                if failed:
+                    MESSAGE_FLUSH_TOTAL.labels("error").inc(len(failed))
+                    logger.error(f"drop {len(failed)} messages, session_ids={[row['session_id'] for row in failed]}")
+                return
+            logger.warning(f"database unavailable, retry {len(rows)} messages in {delay}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+    @staticmethod
+    async def _healthy() -> bool:
+        try:
+            async for sess in get_session():
+                await sess.execute(text("SELECT 1"))
+            return True
+        except Exception as err:
+            logger.warning(f"database health check failed: {type(err).__name__}")
+            return False
+
+    async def _insert_batch(self, rows: List[dict]) -> bool:
+        for attempt in range(self.retries):
+            start = datetime.now().timestamp()
+            try:
+                async for sess in get_session():
+                    await sess.execute(insert(Message).values(rows))
+                    await sess.commit()
+                MESSAGE_FLUSH_SECONDS.observe(datetime.now().timestamp() - start)
+                MESSAGE_FLUSH_TOTAL.labels("ok").inc(len(rows))
+                return True
+            except Exception as err:
+                logger.warning(f"flush {len(rows)} messages failed, {attempt=}: {type(err).__name__}")
+                await asyncio.sleep(0.5 * 2**attempt)
+        return False
+
+    @staticmethod
+    async def _insert_rows(rows: List[dict]) -> List[dict]:
+        failed = []
+        for row in rows:
+            try:
+                async for sess in get_session():
+                    await MessageDao(Message, sess).create(row)
+                MESSAGE_FLUSH_TOTAL.labels("ok").inc()
+            except Exception as err:
+                logger.warning(f"insert message of session {row['session_id']} failed: {type(err).__name__}")
+                failed.append(row)
+        return failed
+
+    async def close(self):
+        """
+        停止接收新消息，最多等待 close_timeout 秒写完队列，超时后放弃并记录未写入的条数
+        """
+        if not self.running:
+            return
+        self._closing = True
+        try:
+            await asyncio.wait_for(self._drain(), self.close_timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            logger.error(f"message writer close timeout, {self._queue.qsize()} queued messages not written")
+        self._task = None
+        MESSAGE_QUEUE_DEPTH.set(0)
+
+    async def _drain(self):
+        await self._queue.put(None)
+        await self._task
+        # 关闭前已通过检查、排在结束标记之后的消息
+        rows = []
+        while not self._queue.empty():
+            row = self._queue.get_nowait()
+            if row is not None:
+                rows.append(row)
+        if rows:
+            await self._flush(rows)
+
+
+message_writer = MessageWriter(
+    settings.chat.message_batch_size,
+    settings.chat.message_flush_interval,
+    settings.chat.message_queue_size,
+    put_timeout=settings.chat.message_put_timeout,
+    close_timeout=settings.chat.message_close_timeout,
+)
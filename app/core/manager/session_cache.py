@@ -0,0 +1,74 @@
+import logging
+from typing import Optional
+
+from prometheus_client import Counter
+
+from app.config import settings
+from app.core.client.redis import redis_client
+from app.core.schema import Session
+from app.core.util import LRUCache
+
+logger = logging.getLogger(__name__)
+
+SESSION_CACHE_TOTAL = Counter(
+    name="session_cache_total",
+    documentation="Total count of session cache lookups by tier",
+    labelnames=["tier"],
+)
+
+
+class SessionCache:
+    """
+    会话信息的读穿缓存：进程内 LRU（带 ttl）+ redis 两级
+    会话的归属不会变化，其余字段变化时由 HistoryManager 失效
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: int = 60, redis_ttl: int = 60 * 60 * 24):
+        self.local: LRUCache[Session] = LRUCache(maxsize, ttl)
+        self.redis_ttl = redis_ttl
+
+    @staticmethod
+    def key(session_id: int) -> str:
+        return f"chat_session_{session_id}"
+
+    async def get(self, session_id: int) -> Optional[Session]:
+        sess = self.local.get(session_id)
+        if sess is not None:
+            SESSION_CACHE_TOTAL.labels("local").inc()
+            return sess
+        try:
+            sess = await redis_client.get(self.key(session_id))
+        except Exception as err:
+            logger.error(f"session cache get error: {err}")
+            sess = None
+        if sess is None:
+            SESSION_CACHE_TOTAL.labels("miss").inc()
+            return None
+        SESSION_CACHE_TOTAL.labels("redis").inc()
+        self.local.set(session_id, sess)
+        return sess
+
+    async def set(self, sess) -> Optional[Session]:
+        try:
+            sess = Session.model_validate(sess)
+            self.local.set(sess.session_id, sess)
+            await redis_client.set(self.key(sess.session_id), sess, ex=self.redis_ttl)
+        except Exception as err:
+            logger.error(f"session cache set error: {err}")
+            return None
+        return sess
+
+    async def delete(self, session_id: int):
+        # 其他 worker 的进程内缓存在 ttl 后过期
+        self.local.pop(session_id)
+        try:
+            await redis_client.set(self.key(session_id), None, ex=1)
+        except Exception as err:
+            logger.error(f"session cache delete error: {err}")
+
+
+session_cache = SessionCache(
+    settings.chat.session_cache_size,
+    settings.chat.session_cache_ttl,
+    settings.chat.session_cache_redis_ttl,
+)
@@ -0,0 +1,144 @@
+import hashlib
+import logging
+import re
+import time
+import unicodedata
+from typing import Optional
+
+import numpy as np
+from prometheus_client import Counter
+
+from app.config import settings
+from app.core.client.jina import jina_embedding
+from app.core.client.redis import redis_client
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_TOTAL = Counter(
+    name="answer_cache_total",
+    documentation="Total count of answer cache lookups",
+    labelnames=["result"],
+)
+
+
+class AnswerCache:
+    """
+    问答结果缓存，key 为 (归一化问题, 选择的知识库, 检索到的文档)
+    exact: 问题归一化后完全一致
+    semantic: 同一知识库/文档范围内，问题向量余弦相似度超过阈值
+    每个范围的问题向量存于 redis hash（answer key -> 向量），最近使用时间存于 sorted set，
+    保留最近 max_entries 个（LRU），答案按 ttl 过期
+    """
+
+    def __init__(self, ttl: int, max_entries: int, semantic: bool, threshold: float):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.semantic = semantic
+        self.threshold = threshold
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        question = unicodedata.normalize("NFKC", question).lower()
+        question = re.sub(r"\s+", " ", question).strip()
+        return question.rstrip("?？。.!！ ")
+
+    @staticmethod
+    def _digest(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+    def _scope(self, dbs: list, context: str) -> str:
+        # context 由检索到的文档决定，以其摘要代表检索结果
+        return self._digest(",".join(str(i) for i in sorted(dbs or [])) + "|" + self._digest(context))
+
+    def _answer_key(self, scope: str, question: str) -> str:
+        return f"answer_cache:{scope}:{self._digest(self.normalize(question))}"
+
+    @staticmethod
+    def _vectors_key(scope: str) -> str:
+        return f"answer_cache_vectors:{scope}"
+
+    @staticmethod
+    def _lru_key(scope: str) -> str:
+        return f"answer_cache_lru:{scope}"
+
+    @staticmethod
+    async def _embed(question: str) -> np.ndarray:
+        vector = np.asarray(await jina_embedding.aembed_query(question), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    async def _touch(self, scope: str, key: str):
+        """
+        以时间戳记录最近使用，各 worker 只更新自己的条目，不会互相覆盖
+        """
+        await redis_client.zadd(self._lru_key(scope), {key: time.time()})
+        await redis_client.expire(self._lru_key(scope), self.ttl)
+        await redis_client.expire(self._vectors_key(scope), self.ttl)
+
+    async def _forget(self, scope: str, keys: list):
+        if keys:
+            await redis_client.hdel(self._vectors_key(scope), *keys)
+            await redis_client.zrem(self._lru_key(scope), *keys)
+
+    async def _semantic_get(self, question: str, scope: str) -> Optional[str]:
+        # 范围内没有条目时不请求 embedding
+        if not await redis_client.hlen(self._vectors_key(scope)):
+            return None
+        vector = await self._embed(question)
+        entries = await redis_client.hgetall(self._vectors_key(scope))
+        if not entries:
+            return None
+        keys = [key.decode() if isinstance(key, bytes) else key for key in entries]
+        matrix = np.frombuffer(b"".join(entries.values()), dtype=np.float32).reshape(len(keys), -1)
+        sims = matrix @ vector
+        best = int(np.argmax(sims))
+        if sims[best] < self.threshold:
+            return None
+        answer = await redis_client.get(keys[best])
+        if not answer:
+            # 答案已过期，清理对应的向量
+            await self._forget(scope, [keys[best]])
+            return None
+        logger.info(f"answer_cache semantic hit {float(sims[best])=}")
+        await self._touch(scope, keys[best])
+        return answer
+
+    async def get(self, question: str, dbs: list, context: str) -> Optional[str]:
+        scope = self._scope(dbs, context)
+        answer = await redis_client.get(self._answer_key(scope, question))
+        if answer:
+            ANSWER_CACHE_TOTAL.labels("exact").inc()
+            return answer
+
+        if self.semantic:
+            answer = await self._semantic_get(question, scope)
+            if answer:
+                ANSWER_CACHE_TOTAL.labels("semantic").inc()
+                return answer
+
+        ANSWER_CACHE_TOTAL.labels("miss").inc()
+        return None
+
+    async def set(self, question: str, dbs: list, context: str, answer: str):
+        if not answer:
+            return
+        scope = self._scope(dbs, context)
+        key = self._answer_key(scope, question)
+        await redis_client.set(key, answer, ex=self.ttl)
+
+        if self.semantic:
+            vector = await self._embed(question)
+            await redis_client.hset(self._vectors_key(scope), key, vector.tobytes())
+            await self._touch(scope, key)
+            # 超出 max_entries 时按时间戳淘汰最久未用的条目
+            overflow = await redis_client.zcard(self._lru_key(scope)) - self.max_entries
+            if overflow > 0:
+                stale = await redis_client.zrange(self._lru_key(scope), 0, overflow - 1)
+                await self._forget(scope, [k.decode() if isinstance(k, bytes) else k for k in stale])
+
+
+answer_cache = AnswerCache(
+    settings.chat.answer_cache_ttl,
+    settings.chat.answer_cache_size,
+    settings.chat.answer_cache_semantic,
+    settings.chat.answer_cache_threshold,
+)
@@ -1,24 +1,36 @@
 import asyncio
 import logging
 import uuid
+from datetime import datetime
 from typing import Optional, List, Annotated, Tuple
 
 from orjson import orjson
 from fastapi import Depends
+from prometheus_client import Counter
 from pydantic import BaseModel
 
+from app.config import settings
 from app.config.v3 import get_model_and_request_message_for_chat
 from app.core.client import ai_client
+from app.core.client.openai import AI_REQUEST_FIRST_TOKEN_SECONDS
 from app.core.client.redis import redis_client
 from app.core.enums import Role, StreamStatus
 from app.core.manager import HistoryManager, get_history_manager
 # from app.core.schema import MessageData, TextPayload
 from app.core.service import knowledge_service
+from app.core.service.answer_cache import answer_cache
+from app.core.service.history_summary import history_summarizer
 
 logger = logging.getLogger(__name__)
 
 CHAT_KNOWLEDGE_ID = 0
 
+SPECULATIVE_RAG_TOTAL = Counter(
+    name="speculative_rag_total",
+    documentation="Total count of speculative retrievals by outcome",
+    labelnames=["outcome"],
+)
+
 
 class KnowledgeContextCache(BaseModel):
     context: str
@@ -29,6 +41,8 @@ class ChatService:
 
     def __init__(self, history_manager):
         self.history_manager = history_manager
+        self._stream_answer: Optional[Tuple[int, int, str]] = None
+        self._stream_cache: Optional[tuple] = None
 
     async def chat(
         self,
@@ -42,34 +56,132 @@ class ChatService:
         session = await self.history_manager.get_session_by_id(session_id, user_id)
 
         question = text
-        
+        chat_history = await self.load_history(session_id, chat_history)
         await self.history_manager.create_message(session.session_id, user_id, Role.USER, question)
 
-
-        context, filepaths = await self.get_knowledge_context(session_id, chat_history, question, dbs)
-        # print(context, filepaths)
-        str_list = []
+        summary, chat_history = await self.compact_history(session_id, chat_history)
+        context, filepaths = await self.get_knowledge_context(session_id, chat_history, question, dbs, summary)
         message_id = str(uuid.uuid4())
-        # async for chunk in self.get_answer(message_id, chat_history, context, question):
-        #     data = {"content": chunk}
-        #     str_list.append(chunk)
-        #     data = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_DATACLASS)
-        #     yield b"data: " + data + b"\n\n"
-        answer = await self.get_answer(message_id, chat_history, context, question)
-        reference = f"找到 {len(filepaths)} 篇资料参考：\n" + "\n".join(filepaths)
-        # print(filepaths)
-        # answer = '\n'.join(str_list)
+        answer = await self.get_answer(message_id, chat_history, context, question, dbs, summary)
         logger.info((f"quest {text=}, answer {answer=}"))
         if len(filepaths):
-            answer += "\n\n"+reference
-            # data  = {"content": reference}
-            # data = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_DATACLASS)
-            # yield b"data: " + data + b"\n\n"
+            answer += "\n\n" + self.get_reference(filepaths)
 
         await self.history_manager.create_message(session_id, user_id, Role.ASSISTANT, answer)
-        # yield f"data: [done]\n\n"
         return answer
 
+    async def chat_stream(
+        self,
+        user_id: int,
+        session_id: int,
+        text: Optional[str],
+        audio: Optional[str],
+        chat_history: Optional[list],
+        dbs: Optional[list],
+    ):
+        """
+        SSE 流式回答，参考资料作为最后一个事件发送；完整回答由 save_stream_answer 在响应结束后落库
+        会话校验和检索在返回响应前完成，错误经异常处理返回；返回的生成器只负责输出回答
+        """
+        start = datetime.now().timestamp()
+        session = await self.history_manager.get_session_by_id(session_id, user_id)
+
+        question = text
+        chat_history = await self.load_history(session_id, chat_history)
+        await self.history_manager.create_message(session.session_id, user_id, Role.USER, question)
+
+        summary, chat_history = await self.compact_history(session_id, chat_history)
+        context, filepaths = await self.get_knowledge_context(session_id, chat_history, question, dbs, summary)
+        model, request_message = get_model_and_request_message_for_chat(chat_history, context, question, summary)
+        cached = await self.get_cached_answer(chat_history, context, question, dbs)
+        return self._stream_answer_events(
+            start, user_id, session_id, model, request_message, cached, filepaths, (chat_history, context, question, dbs)
+        )
+
+    async def _stream_answer_events(
+        self,
+        start: float,
+        user_id: int,
+        session_id: int,
+        model: str,
+        request_message: list,
+        cached: Optional[str],
+        filepaths: List[str],
+        cache_args: tuple,
+    ):
+        str_list = []
+        chunks = self._once(cached) if cached else ai_client.chat_stream(model, request_message)
+        try:
+            async for chunk in chunks:
+                if not str_list:
+                    AI_REQUEST_FIRST_TOKEN_SECONDS.labels("chat.send_msg", model).observe(
+                        datetime.now().timestamp() - start
+                    )
+                str_list.append(chunk)
+                yield self.sse_event({"content": chunk})
+        except Exception as err:
+            # 响应头已经发出，错误只能作为事件告知客户端；不完整的回答不落库
+            logger.error(f"chat_stream error: {err}")
+            yield self.sse_event({"message": "生成回答失败，请重试"}, event="error")
+            return
+
+        answer = "".join(str_list)
+        logger.info(f"chat_stream {session_id=}, answer {answer=}")
+        if not cached:
+            self._stream_cache = (*cache_args, answer)
+        if len(filepaths):
+            reference = self.get_reference(filepaths)
+            answer += "\n\n" + reference
+            yield self.sse_event({"content": reference, "filepaths": filepaths}, event="reference")
+
+        self._stream_answer = (session_id, user_id, answer)
+        yield b"data: [done]\n\n"
+
+    async def save_stream_answer(self):
+        if self._stream_cache is not None:
+            await self.set_cached_answer(*self._stream_cache)
+            self._stream_cache = None
+        if self._stream_answer is None:
+            return
+        session_id, user_id, answer = self._stream_answer
+        self._stream_answer = None
+        await self.history_manager.create_message(session_id, user_id, Role.ASSISTANT, answer)
+
+    @staticmethod
+    async def _once(text: str):
+        yield text
+
+    @staticmethod
+    async def get_cached_answer(chat_history: Optional[list], context: str, question: str, dbs: list) -> Optional[str]:
+        # 只缓存首轮问答，多轮对话的回答依赖对话历史
+        if not settings.chat.answer_cache or chat_history:
+            return None
+        try:
+            return await answer_cache.get(question, dbs, context)
+        except Exception as err:
+            logger.error(f"answer_cache get error: {err}")
+            return None
+
+    @staticmethod
+    async def set_cached_answer(chat_history: Optional[list], context: str, question: str, dbs: list, answer: str):
+        if not settings.chat.answer_cache or chat_history:
+            return
+        try:
+            await answer_cache.set(question, dbs, context, answer)
+        except Exception as err:
+            logger.error(f"answer_cache set error: {err}")
+
+    @staticmethod
+    def sse_event(data: dict, event: Optional[str] = None) -> bytes:
+        data = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_DATACLASS)
+        if event:
+            return b"event: " + event.encode() + b"\ndata: " + data + b"\n\n"
+        return b"data: " + data + b"\n\n"
+
+    @staticmethod
+    def get_reference(filepaths: List[str]) -> str:
+        return f"找到 {len(filepaths)} 篇资料参考：\n" + "\n".join(filepaths)
+
     @staticmethod
     async def get_context_from_redis(session_id: int) -> Tuple[str, List[str]]:
         key = f"chat_context_{session_id}"
@@ -88,26 +200,85 @@ class ChatService:
         )
         await redis_client.set(key, cache)
 
+    async def load_history(self, session_id: int, chat_history: Optional[list]) -> list:
+        """
+        客户端未传对话历史时由服务端加载，需在写入本轮问题之前调用
+        """
+        if chat_history is not None:
+            return chat_history
+        return await self.history_manager.get_chat_history(session_id, settings.chat.server_history_size)
+
+    @staticmethod
+    async def compact_history(session_id: int, chat_history: Optional[list]) -> Tuple[str, Optional[list]]:
+        """
+        返回 (较早对话的摘要, 需要原样放入 prompt 的消息)
+        """
+        if not settings.chat.history_summary:
+            return "", chat_history
+        return await history_summarizer.compact(session_id, chat_history)
+
     @staticmethod
-    async def get_knowledge_context(session_id: int, chat_history: Optional[list], question: str, dbs: list):
+    async def get_knowledge_context(
+        session_id: int, chat_history: Optional[list], question: str, dbs: list, summary: str = ""
+    ):
         context, filepaths = await ChatService.get_context_from_redis(session_id)
         if len(chat_history) == 0:
             context, filepaths = await knowledge_service.query_and_rerank(dbs, question)
-        elif await knowledge_service.is_need_rag(chat_history, context, question):
+        elif settings.chat.speculative_rag:
+            context, filepaths = await ChatService.speculative_query(
+                chat_history, context, filepaths, question, dbs, summary
+            )
+        elif await knowledge_service.is_need_rag(chat_history, context, question, summary):
             context, filepaths = await knowledge_service.query_and_rerank(dbs, question)
         logger.info(f"get_knowledge_context {context=}")
         await ChatService.set_context_to_redis(session_id, context, filepaths)
         return context, filepaths
 
     @staticmethod
-    async def get_answer(message_id: str, chat_history: Optional[list], context: str, question: str):
+    async def speculative_query(
+        chat_history: list, context: str, filepaths: List[str], question: str, dbs: list, summary: str = ""
+    ) -> Tuple[str, List[str]]:
+        """
+        检索与 is_need_rag 同时开始，判断为需要检索时使用检索结果，否则取消/丢弃检索
+        """
+        retrieval = asyncio.create_task(knowledge_service.query_and_rerank(dbs, question))
+        try:
+            need_rag = await knowledge_service.is_need_rag(chat_history, context, question, summary)
+        except BaseException:
+            retrieval.cancel()
+            raise
+
+        if need_rag:
+            SPECULATIVE_RAG_TOTAL.labels("used").inc()
+            return await retrieval
+
+        if retrieval.done():
+            # 检索已完成但结果被丢弃；取出异常避免 "exception was never retrieved"
+            if not retrieval.cancelled():
+                retrieval.exception()
+            SPECULATIVE_RAG_TOTAL.labels("wasted").inc()
+        else:
+            retrieval.cancel()
+            SPECULATIVE_RAG_TOTAL.labels("cancelled").inc()
+        return context, filepaths
+
+    @staticmethod
+    async def get_answer(
+        message_id: str,
+        chat_history: Optional[list],
+        context: str,
+        question: str,
+        dbs: Optional[list] = None,
+        summary: str = "",
+    ):
         logger.debug("get_answer")
-        model, request_message = get_model_and_request_message_for_chat(chat_history, context, question)
-        str_list = []
-        # async for chunk in ai_client.chat_return_sentence(model, request_message):
-        #     yield chunk
+        answer = await ChatService.get_cached_answer(chat_history, context, question, dbs)
+        if answer:
+            return answer
+        model, request_message = get_model_and_request_message_for_chat(chat_history, context, question, summary)
         answer = await ai_client.chat_once(model, request_message)
         logger.info(f"get_answer done, {answer=}")
+        await ChatService.set_cached_answer(chat_history, context, question, dbs, answer)
         return answer
 
 
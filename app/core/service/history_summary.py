@@ -0,0 +1,149 @@
+import asyncio
+import hashlib
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from prometheus_client import Counter
+from pydantic import BaseModel
+
+from app.config import settings
+from app.config.v3 import get_model_and_request_message_for_summary
+from app.core.client import ai_client
+from app.core.client.redis import redis_client
+from app.core.schema import MessageData
+from app.core.util import token_counter
+
+logger = logging.getLogger(__name__)
+
+HISTORY_SUMMARY_TOTAL = Counter(
+    name="history_summary_total",
+    documentation="Total count of history summary refreshes by result",
+    labelnames=["result"],
+)
+
+
+# 用最后几条已摘要消息的摘要值定位摘要覆盖到的位置，历史窗口滑动后仍能对齐
+TAIL_MESSAGES = 2
+
+
+class HistorySummary(BaseModel):
+    summary: str
+    tail: str
+
+
+class HistorySummarizer:
+    """
+    对话历史压缩：最近 keep_turns 轮原样保留，更早的消息滚动合并进按会话缓存在 redis 的摘要
+    摘要在后台更新，不阻塞当前轮次
+    """
+
+    def __init__(self, keep_turns: int = 3, batch_turns: int = 2, ttl: int = 60 * 60 * 24):
+        self.keep_turns = keep_turns
+        self.batch_turns = batch_turns
+        self.ttl = ttl
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    @staticmethod
+    def key(session_id: int) -> str:
+        return f"chat_summary_{session_id}"
+
+    @staticmethod
+    def digest(messages: List[MessageData]) -> str:
+        h = hashlib.sha1()
+        for message in messages:
+            h.update(f"{message['role']}\0{message['content']}\0".encode())
+        return h.hexdigest()
+
+    async def get(self, session_id: int) -> Optional[HistorySummary]:
+        try:
+            return await redis_client.get(self.key(session_id))
+        except Exception as err:
+            logger.error(f"history summary get error: {err}")
+            return None
+
+    async def compact(self, session_id: int, chat_history: Optional[List[MessageData]]) -> Tuple[str, List[MessageData]]:
+        """
+        返回 (摘要, 需要原样保留的消息)
+        """
+        keep = self.keep_turns * 2
+        if not chat_history or len(chat_history) <= keep:
+            return "", chat_history or []
+        older, recent = chat_history[:-keep], chat_history[-keep:]
+
+        cache = await self.get(session_id)
+        summarized = self.locate(cache, older)
+        summary = cache.summary if summarized else ""
+        pending = older[summarized:]
+        if len(pending) >= self.batch_turns * 2:
+            self.schedule(session_id, summary, pending, self.digest(older[-TAIL_MESSAGES:]))
+        # 尚未并入摘要的消息原样保留，超出 token 上限时由 pack_history 丢弃最早的部分
+        return summary, pending + recent
+
+    def locate(self, cache: Optional[HistorySummary], older: List[MessageData]) -> int:
+        """
+        返回 older 中已并入摘要的消息条数，对不上时返回 0（重新摘要）
+        """
+        if cache is None:
+            return 0
+        for end in range(len(older), 0, -1):
+            if self.digest(older[max(end - TAIL_MESSAGES, 0):end]) == cache.tail:
+                return end
+        return 0
+
+    @staticmethod
+    def chunks(messages: List[MessageData], max_tokens: int) -> List[List[MessageData]]:
+        """
+        按 token 数切分消息，单条消息超出 max_tokens 时截断
+        """
+        chunks, chunk, used = [], [], 0
+        for message in messages:
+            content = token_counter.truncate(message["content"], max_tokens)
+            tokens = token_counter.count(content)
+            if chunk and used + tokens > max_tokens:
+                chunks.append(chunk)
+                chunk, used = [], 0
+            chunk.append({"role": message["role"], "content": content})
+            used += tokens
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    def schedule(self, session_id: int, summary: str, pending: List[MessageData], tail: str):
+        task = self._tasks.get(session_id)
+        if task is not None and not task.done():
+            return
+        task = asyncio.create_task(self.refresh(session_id, summary, pending, tail))
+        self._tasks[session_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(session_id, None))
+
+    async def refresh(self, session_id: int, summary: str, pending: List[MessageData], tail: str):
+        try:
+            # 历史可能很长（首次开启、摘要过期或对不上时是全部较早的历史），分段滚动合并
+            for chunk in self.chunks(pending, settings.chat.summary_input_tokens):
+                model, request_message = get_model_and_request_message_for_summary(summary, chunk)
+                summary = await ai_client.chat_once(model, request_message, temperature=0.3)
+                if not summary:
+                    raise ValueError("empty summary")
+                summary = token_counter.truncate(summary, settings.chat.summary_tokens)
+            await redis_client.set(
+                self.key(session_id),
+                HistorySummary(summary=summary, tail=tail),
+                ex=self.ttl,
+            )
+            HISTORY_SUMMARY_TOTAL.labels("ok").inc()
+        except Exception as err:
+            HISTORY_SUMMARY_TOTAL.labels("error").inc()
+            logger.error(f"history summary refresh error: {err}")
+
+    async def close(self):
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+history_summarizer = HistorySummarizer(
+    settings.chat.history_turns,
+    settings.chat.history_summary_batch_turns,
+    settings.chat.history_summary_ttl,
+)
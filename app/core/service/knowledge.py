@@ -1,128 +1,315 @@
+import asyncio
 import logging
-from typing import List
-import requests
+from typing import Dict, List, Optional, Tuple
 import numpy as np
-from aiohttp import ClientSession
-from langchain_community.vectorstores import FAISS
 from langchain_core.documents import Document as langchain_Document
 
 from app.config import settings, v3
 from app.core.client import ai_client
+from app.core.client.http import http_client
 from app.core.client.jina import jina_embedding
+from app.core.client.redis import redis_client
 from app.core.database import KnowledgeDao
 from app.core.database.db import get_session
-from app.core.exception import BadRequest, ServerException
+from app.core.exception import BadRequest, ServerException, ServiceUnavailable
+from app.core.knowledge import IndexManager, KnowledgeStore, SearchExecutor
+from app.core.knowledge.bm25 import is_identifier_query, reciprocal_rank_fusion
+from app.core.knowledge.router import get_query_router
 from app.core.model import Knowledge
 from app.core.schema import MessageData
+from app.core.service.rerank_cache import RerankCache
+from app.core.util import token_counter
 
 logger = logging.getLogger(__name__)
 
+# 请求等待启动加载完成的最长时间（秒）
+READY_TIMEOUT = 30
+
+# 整数计数器，INCR 原子递增；redis_client.get/set 会 pickle，读写都用 INCRBY（换了 key 名，避免旧的 pickle 值使 INCR 报错）
+RELOAD_GENERATION_KEY = "knowledge_reload_counter"
+
 
 class KnowledgeService:
-    def __init__(self, base_dir: str, rerank_url: str, api_key: str, model: str):
-        self.dbs = {}
+    def __init__(
+        self,
+        base_dir: str,
+        rerank_url: str,
+        api_key: str,
+        model: str,
+        indexes: IndexManager = None,
+        search_executor: SearchExecutor = None,
+        rerank_cache: RerankCache = None,
+        reload_interval: int = 0,
+        hybrid_search: bool = False,
+        query_routing: bool = False,
+    ):
         self.base_dir = base_dir
         self.url = rerank_url
         self.api_key = api_key
         self.model = model
-        
-    async def _load_dbs(self):
-        if self.dbs:
+        self.indexes = indexes or IndexManager(base_dir, jina_embedding)
+        self.search_executor = search_executor or SearchExecutor()
+        self.rerank_cache = rerank_cache or RerankCache(1024, 3600)
+        self.reload_interval = reload_interval
+        self.hybrid_search = hybrid_search
+        self.query_routing = query_routing
+        self._catalog_task: Optional[asyncio.Task] = None
+        self._watch_task: Optional[asyncio.Task] = None
+        self._startup_task: Optional[asyncio.Task] = None
+        self._reload_generation = None
+        self._ready = asyncio.Event()
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    async def wait_ready(self):
+        """
+        检索前等待启动加载完成，超时返回 503 而不是一直挂起请求
+        """
+        if self._ready.is_set():
             return
+        try:
+            await asyncio.wait_for(self._ready.wait(), READY_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise ServiceUnavailable("knowledge is loading")
+
+    def start(self):
+        """
+        在后台加载，lifespan 不等待加载完成，worker 立即开始接收请求，/readyz 在加载完成前返回 503
+        """
+        if self._startup_task is None:
+            self._startup_task = asyncio.create_task(self.startup())
+
+    async def startup(self):
+        """
+        加载知识库列表并预加载常驻的知识库，加载完成后 ready 才置为 True；失败时退避重试
+        """
+        delay = 1
+        while True:
+            try:
+                await self._load_dbs()
+                await self.indexes.preload()
+                break
+            except Exception as err:
+                logger.error(f"knowledge startup error, retry in {delay}s: {err}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 60)
+        self._ready.set()
+        if self.reload_interval > 0:
+            self._watch_task = asyncio.create_task(self._watch())
+
+    def version(self, knowledge_id: list) -> str:
+        return ",".join(f"{i}:{self.indexes.version(i)}" for i in sorted(knowledge_id))
+
+    async def shutdown(self):
+        if self._startup_task:
+            self._startup_task.cancel()
+        if self._watch_task:
+            self._watch_task.cancel()
+        self.search_executor.shutdown()
+
+    async def reload(self, refresh_catalog: bool = True) -> list[int]:
+        """
+        重新读取 t_knowledge 并热加载发生变化的知识库，同时清空旧版本的 rerank 缓存
+        """
+        folders = None
+        if refresh_catalog:
+            async for sess in get_session():
+                result = await KnowledgeDao(Knowledge, sess).list()
+                folders = {item.knowledge_id: item.folder for item in result}
+        changed = await self.indexes.reload(folders)
+        if changed:
+            self.rerank_cache.clear()
+        return changed
+
+    async def request_reload(self) -> list[int]:
+        """
+        管理端触发：递增 redis 中的 reload 版本通知其他 worker，并立即在当前 worker 重新加载
+        """
+        self._reload_generation = int(await redis_client.incr(RELOAD_GENERATION_KEY))
+        return await self.reload()
+
+    async def _watch(self):
+        """
+        定期检查 redis 中的 reload 版本以及常驻知识库的索引文件版本
+        """
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                generation = int(await redis_client.incrby(RELOAD_GENERATION_KEY, 0))
+                refresh_catalog = generation != self._reload_generation
+                self._reload_generation = generation
+                await self.reload(refresh_catalog)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                logger.error(f"knowledge watch error: {err}")
+
+    async def _load_dbs(self):
+        """
+        加载知识库列表，索引本身在首次使用时由 IndexManager 加载
+        并发调用共享同一次加载，失败后下次调用重新加载
+        """
+        if self._catalog_task is None:
+            self._catalog_task = asyncio.create_task(self._load_catalog())
+        task = self._catalog_task
+        try:
+            await asyncio.shield(task)
+        except Exception:
+            if self._catalog_task is task:
+                self._catalog_task = None
+            raise
 
+    async def _load_catalog(self):
         result = []
         async for sess in get_session():
             result = await KnowledgeDao(Knowledge, sess).list()
-        
-        for item in result:
-            if item.knowledge_id != 6:
-                continue
-            self.dbs[item.knowledge_id] = FAISS.load_local(
-                f"{self.base_dir}/{item.folder}",
-                embeddings=jina_embedding,
-                allow_dangerous_deserialization=True,
-            )
-        print(len(self.dbs))
 
-    async def get_related_knowledge(
-        self, knowledge_id: list, query: str, k: int,threshold=0.85
-    ):
+        self.indexes.set_catalog({item.knowledge_id: item.folder for item in result})
+        logger.info(f"_load_dbs done, {len(result)=}")
+
+    async def _get_stores(self, knowledge_id: list) -> List[KnowledgeStore]:
+        await self.wait_ready()
         await self._load_dbs()
-        docs = []
         for knowledge in knowledge_id:
-            db = self.dbs.get(knowledge)
-            if not db:
+            if knowledge not in self.indexes:
                 raise BadRequest(f"invalid knowledge_id {knowledge_id}")
+        return await asyncio.gather(*[self.indexes.get(knowledge) for knowledge in knowledge_id])
+
+    async def similarity_search_many(
+        self, knowledge_id: list, embedding, k: int
+    ) -> List[Tuple[langchain_Document, float, KnowledgeStore]]:
+        """
+        用同一个 query 向量并发检索多个知识库，按分数合并后取全局 top-k
+        返回的分数越大越相关，附带命中的知识库用于上下文扩展
+        """
+        stores = await self._get_stores(knowledge_id)
+        results = await asyncio.gather(*[self.search_executor.run(db.search, embedding, k) for db in stores])
+        scored = [(doc, score, db) for db, docs in zip(stores, results) for doc, score in docs]
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored[:k]
 
+    async def keyword_search_many(
+        self, knowledge_id: list, query: str, k: int
+    ) -> List[Tuple[langchain_Document, float, KnowledgeStore]]:
+        """
+        在多个知识库的本地 BM25 索引上检索，按分数合并后取全局 top-k
+        """
+        stores = await self._get_stores(knowledge_id)
+        results = await asyncio.gather(*[self.search_executor.run(db.keyword_search, query, k) for db in stores])
+        scored = [(doc, score, db) for db, docs in zip(stores, results) for doc, score in docs]
+        scored.sort(key=lambda x: x[1], reverse=True)
+        return scored[:k]
 
-            retriever = db.as_retriever(search_kwargs={"k": k})
-            docs.extend(retriever.invoke(query))
+    async def vector_search(
+        self, knowledge_id: list, query: str, k: int
+    ) -> List[Tuple[langchain_Document, float, KnowledgeStore]]:
+        embedding = await jina_embedding.aembed_query(query)
+        return await self.similarity_search_many(knowledge_id, embedding, k)
+
+    async def get_related_knowledge(
+        self, knowledge_id: list, query: str, k: int,threshold=0.85
+    ) -> Tuple[List[langchain_Document], Dict[int, KnowledgeStore]]:
+        """
+        返回检索到的 chunk 以及 knowledge_id -> 检索时使用的知识库
+        扩展上下文沿用这些引用，不再经 IndexManager 取（避免重新加载已淘汰的知识库或打乱 LRU 顺序）
+        """
+        if not self.hybrid_search:
+            scored = await self.vector_search(knowledge_id, query, k)
+            docs = [doc for doc, _, _ in scored]
+        elif is_identifier_query(query):
+            # 纯编号查询只走关键词检索，省掉 embedding 请求
+            scored = await self.keyword_search_many(knowledge_id, query, k)
+            if not scored:
+                scored = await self.vector_search(knowledge_id, query, k)
+            docs = [doc for doc, _, _ in scored]
+        else:
+            vector_scored, keyword_scored = await asyncio.gather(
+                self.vector_search(knowledge_id, query, k),
+                self.keyword_search_many(knowledge_id, query, k),
+            )
+            scored = vector_scored + keyword_scored
+            docs = reciprocal_rank_fusion(
+                [[doc for doc, _, _ in vector_scored], [doc for doc, _, _ in keyword_scored]], k
+            )
+        stores = {db.knowledge_id: db for _, _, db in scored}
         logger.info(f"get_related_knowledge {len(docs)=}")
-        return docs[:k]
+        return docs, stores
 
     async def rerank_content(
-        self, query: str, docs: List[langchain_Document], top_n: int = 5
+        self, query: str, docs: List[langchain_Document], top_n: int = 5, version: str = ""
     ):
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
-        payload = {"model":self.model, "query": query, "documents": [doc.page_content[:512] for doc in docs]}
+        documents = [doc.page_content[:512] for doc in docs]
+        cache_key = self.rerank_cache.make_key(version, self.model, query, documents)
+        indexes = await self.rerank_cache.get(cache_key)
+        if indexes is not None:
+            return [docs[i] for i in indexes[:top_n]]
+
+        payload = {"model":self.model, "query": query, "documents": documents}
         logger.info(f"rerank {self.url=}, {payload=}")
         try:
-            response = requests.request("POST", url=self.url, json=payload, headers=headers)
-            if response.status_code != 200:
-                raise ServerException(
-                    f"Error Code {response.status}, {response.text}"
-                )
-            relevance = response.json()
+            relevance = await http_client.post_json("jina.rerank", self.url, payload, headers)
             logger.info(f"rerank {relevance=}")
-            text_selected = [docs[dp["index"]] for dp in relevance["results"][:top_n]]
+            indexes = [dp["index"] for dp in relevance["results"]]
+            await self.rerank_cache.set(cache_key, indexes)
+            text_selected = [docs[i] for i in indexes[:top_n]]
             return text_selected
 
         except Exception as err:
             logger.error(f"rerank_content error: {err}")
             raise ServerException("rerank_content failed")
 
+    async def route(self, knowledge_id: list, query: str) -> list:
+        """
+        问题中带有法规编号时，只检索对应法规的知识库
+        """
+        if not self.query_routing:
+            return knowledge_id
+        await self.wait_ready()
+        await self._load_dbs()
+        routed = get_query_router().route(query, knowledge_id, self.indexes)
+        if routed != knowledge_id:
+            logger.info(f"route {knowledge_id=} -> {routed=}")
+        return routed
+
     async def query_and_rerank(self, knowledge_id: list, query, top_n=5):
-        docs = await self.get_related_knowledge(knowledge_id, query, top_n)
+        knowledge_id = await self.route(knowledge_id, query)
+        docs, stores = await self.get_related_knowledge(knowledge_id, query, top_n)
         if not docs:
             return "", []
-        docs = await self.rerank_content(query, docs, top_n)
+        docs = await self.rerank_content(query, docs, top_n, self.version(knowledge_id))
         if not docs:
             return "", []
-        context_str = ""
+        parts = []
+        used = 0
         filepaths = []
         filepaths_dict = {}
         for i, doc in enumerate(docs):
-            if 'raw' not in doc.metadata:
-                page_content = doc.page_content
-            else:
-                index = doc.metadata['raw'].index(doc.page_content)
-                if index > 1000:
-                    page_content = doc.metadata['raw'][:1000] + doc.metadata['raw'][index-1000:index+3000]
-                else:
-                    page_content = doc.metadata['raw'][:index+4000]
-                if 'ammend' in doc.metadata:
-                    page_content += doc.metadata['ammend'][:4000]
-            if (
-                len(context_str) + len(page_content) >= 16000
-                and len(context_str) >= 1
-            ):
+            db = stores.get(doc.metadata.get("knowledge_id"))
+            page_content = db.expand(doc) if db else doc.page_content
+            page_content = token_counter.truncate(page_content, settings.chat.doc_tokens)
+            part = f"文档{i+1}相关内容如下:\n{page_content}\n"
+            tokens = token_counter.count(part)
+            # 按 rerank 顺序装入，第一篇总是保留
+            if used + tokens > settings.chat.context_tokens and parts:
                 break
-            else:
-                context_str += (
-                    f"文档{i+1}相关内容如下:\n{page_content[:8000]}\n"
-                )
-                file_key = "".join(doc.metadata["source"])
-                if file_key not in filepaths_dict:
-                    filepaths.append(doc.metadata["source"])
-                    filepaths_dict[file_key] = None
+            parts.append(part)
+            used += tokens
+            file_key = "".join(doc.metadata["source"])
+            if file_key not in filepaths_dict:
+                filepaths.append(doc.metadata["source"])
+                filepaths_dict[file_key] = None
+        context_str = "".join(parts)
         return context_str, filepaths
 
     @classmethod
     async def is_need_rag(
-        cls, chat_history: List[MessageData], context: str, query: str
+        cls, chat_history: List[MessageData], context: str, query: str, summary: str = ""
     ):
         prompt_template = """你是一个多轮对话系统中的智能助手，当前你的任务是判断：当前轮次用户的提问是否需要在重新在文档库内检索新的知识。
 具体来说，你将接收到的信息如下：
@@ -145,9 +332,7 @@ class KnowledgeService:
 注意，你只需要输出"True"或者"False"，不要输出其他内容。
 """
 
-        chat = ""
-        for message in chat_history:
-            chat += f"{message['role']}: {message['content']}\n"
+        chat = v3.pack_history(chat_history, settings.chat.history_tokens, summary)
 
         _content = prompt_template.format(
             context=context, chat_history=chat, query=query
@@ -163,5 +348,24 @@ class KnowledgeService:
 
 
 knowledge_service = KnowledgeService(
-    settings.knowledge.base_dir, settings.knowledge.rerank_url, settings.knowledge.api_key, settings.knowledge.rerank_model
+    settings.knowledge.base_dir,
+    settings.knowledge.rerank_url,
+    settings.knowledge.api_key,
+    settings.knowledge.rerank_model,
+    IndexManager(
+        settings.knowledge.base_dir,
+        jina_embedding,
+        settings.knowledge.mmap_index,
+        settings.knowledge.max_resident_bytes,
+        settings.knowledge.pinned,
+    ),
+    SearchExecutor(settings.knowledge.search_workers, settings.knowledge.search_concurrency),
+    RerankCache(
+        settings.knowledge.rerank_cache_size,
+        settings.knowledge.rerank_cache_ttl,
+        settings.knowledge.rerank_cache_redis,
+    ),
+    settings.knowledge.reload_interval,
+    settings.knowledge.hybrid_search,
+    settings.knowledge.query_routing,
 )
@@ -0,0 +1,65 @@
+import hashlib
+import logging
+from typing import List, Optional
+
+from prometheus_client import Counter
+
+from app.core.client.redis import redis_client
+from app.core.util import LRUCache
+
+logger = logging.getLogger(__name__)
+
+RERANK_CACHE_TOTAL = Counter(
+    name="rerank_cache_total",
+    documentation="Total count of rerank cache lookups",
+    labelnames=["result"],
+)
+
+
+class RerankCache:
+    """
+    rerank 结果缓存：进程内 LRU + 可选的 redis 共享层
+    key 由 (知识库版本, 模型, query, 候选文档) 的摘要组成，知识库版本变化后旧条目自然失效
+    value 为 rerank 后的候选文档下标顺序
+    """
+
+    def __init__(self, maxsize: int, ttl: int, use_redis: bool = False):
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self._local: LRUCache[List[int]] = LRUCache(maxsize, ttl)
+
+    @staticmethod
+    def make_key(version: str, model: str, query: str, documents: List[str]) -> str:
+        h = hashlib.sha1()
+        for part in (version, model, query, *documents):
+            h.update(part.encode("utf-8"))
+            h.update(b"\0")
+        return f"rerank_cache:{h.hexdigest()}"
+
+    async def get(self, key: str) -> Optional[List[int]]:
+        indexes = self._local.get(key)
+        if indexes is not None:
+            RERANK_CACHE_TOTAL.labels("memory").inc()
+            return indexes
+        if self.use_redis:
+            try:
+                indexes = await redis_client.get(key)
+            except Exception as err:
+                logger.error(f"rerank_cache get error: {err}")
+            if indexes is not None:
+                self._local.set(key, indexes)
+                RERANK_CACHE_TOTAL.labels("redis").inc()
+                return indexes
+        RERANK_CACHE_TOTAL.labels("miss").inc()
+        return None
+
+    async def set(self, key: str, indexes: List[int]):
+        self._local.set(key, indexes)
+        if self.use_redis:
+            try:
+                await redis_client.set(key, indexes, ex=self.ttl)
+            except Exception as err:
+                logger.error(f"rerank_cache set error: {err}")
+
+    def clear(self):
+        self._local.clear()
@@ -1,3 +1,5 @@
+from .lru import LRUCache
 from .snowflake import gen_snowflake_id
+from .tokenizer import TokenCounter, token_counter
 
-__all__ = ["gen_snowflake_id"]
+__all__ = ["LRUCache", "gen_snowflake_id", "TokenCounter", "token_counter"]
@@ -0,0 +1,94 @@
+import logging
+import os
+import re
+import threading
+from typing import List, Optional
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uff00-\uffef]")
+
+# 没有本地 tokenizer 时的估算：中文约 1 字 1 token，其余约 3 字符 1 token（偏保守）
+OTHER_CHARS_PER_TOKEN = 3
+
+
+class TokenCounter:
+    """
+    用本地加载的 tokenizer 计算 token 数，加载失败时按字符估算
+    path 为 tokenizer.json、模型目录或 huggingface 模型名
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._tokenizer = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def tokenizer(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._tokenizer = self._load()
+                    self._loaded = True
+        return self._tokenizer
+
+    def _load(self):
+        if not self.path:
+            logger.warning("tokenizer_path not configured, token counts are estimated")
+            return None
+        # 文件路径（而不是 huggingface 模型名）不存在时是部署问题，按错误记录
+        if os.path.isabs(self.path) and not os.path.exists(self.path):
+            logger.error(f"tokenizer {self.path} not found, token counts are estimated")
+            return None
+        try:
+            from tokenizers import Tokenizer
+
+            if os.path.exists(self.path):
+                file = os.path.join(self.path, "tokenizer.json") if os.path.isdir(self.path) else self.path
+                return Tokenizer.from_file(file)
+            # 模型名：从 huggingface 下载（可用 HF_ENDPOINT 指定镜像）
+            return Tokenizer.from_pretrained(self.path)
+        except Exception as err:
+            logger.error(f"load tokenizer {self.path} failed, token counts are estimated: {err}")
+        return None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        tokenizer = self.tokenizer
+        if tokenizer is not None:
+            return len(tokenizer.encode(text, add_special_tokens=False).ids)
+        cjk = len(CJK_RE.findall(text))
+        return cjk + -(-(len(text) - cjk) // OTHER_CHARS_PER_TOKEN)
+
+    def count_many(self, texts: List[str]) -> List[int]:
+        tokenizer = self.tokenizer
+        if tokenizer is not None and texts:
+            return [len(enc.ids) for enc in tokenizer.encode_batch(texts, add_special_tokens=False)]
+        return [self.count(text) for text in texts]
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        截取前 max_tokens 个 token 对应的文本
+        """
+        if max_tokens <= 0:
+            return ""
+        tokenizer = self.tokenizer
+        if tokenizer is not None:
+            offsets = tokenizer.encode(text, add_special_tokens=False).offsets
+            if len(offsets) <= max_tokens:
+                return text
+            return text[: offsets[max_tokens - 1][1]]
+
+        budget = max_tokens * OTHER_CHARS_PER_TOKEN
+        for i, char in enumerate(text):
+            budget -= OTHER_CHARS_PER_TOKEN if CJK_RE.match(char) else 1
+            if budget < 0:
+                return text[:i]
+        return text
+
+
+token_counter = TokenCounter(settings.chat.tokenizer_path)
@@ -31,8 +31,13 @@ class DBtier2(BaseModel):
 class SendMessageRequest(AnswerRequest):
     user_id: int = Field(description='用户id')
     selected_dbs: Optional[list[int]] = Field(description='选择的数据库',default=[])
+    stream: bool = Field(description='是否以 SSE 流式返回', default=False)
+    server_history: bool = Field(description='由服务端加载对话历史，忽略 chat_history', default=False)
 class UserLogin(BaseModel):
     user_id: int = Field(description='用户id')
+class DeleteSessionRequest(BaseModel):
+    user_id: int = Field(description='用户id')
+    session_id: int = Field(description='会话ID')
 class TaskInitSessionRequest(BaseModel):
     task_id: int = Field(description="任务ID")
     session_type: SessionType = Field(description="会话类型", default=SessionType.TASK_EXERCISE)
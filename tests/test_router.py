@@ -0,0 +1,39 @@
+import pytest
+
+from app.core.knowledge.router import QueryRouter
+
+AVAILABLE = {1, 3, 4, 6, 7, 8, 9, 1013, 1048, 1100, 1155}
+
+
+@pytest.fixture(scope="module")
+def router():
+    return QueryRouter()
+
+
+@pytest.mark.parametrize(
+    "query, selected, expected",
+    [
+        # 点名的编号落在选择范围内时只检索该法规
+        ("R155", [6, 8, 4, 3], [1155]),
+        ("ECE R13 and UN R155", [6], [1013, 1155]),
+        ("ECE 法规和 R155 的区别", [6], [1155]),
+        # 名称不扩展检索范围
+        ("EU法规与R155的区别", [6], [1155]),
+        ("加州排放标准", [6], [6]),
+        ("加州排放标准", [1, 6], [1]),
+        ("Euro NCAP 评分", [8], [8]),
+        # 精确编号可以扩展到未选择的知识库
+        ("R100 要求", [8], [1100]),
+        ("FMVSS 208 气囊", [6], [8]),
+        ("Regulation No. 48", [], [1048]),
+        ("第48号法规", [], [1048]),
+        # 小写 r 紧跟数字时识别，后面有空白时不识别
+        ("r155 是什么", [6], [1155]),
+        ("is 3 r 2 ok", [6], [6]),
+        # 单条法规没有独立知识库时回退到上级分类
+        ("R113", [6], [6]),
+        ("刹车要求", [6], [6]),
+    ],
+)
+def test_route(router, query, selected, expected):
+    assert router.route(query, selected, AVAILABLE) == expected